@@ -1,14 +1,10 @@
-import os
+import time
 import streamlit as st
 from dotenv import load_dotenv
-from src.config import AppConfig, load_app_config
-from src.ingestion import parse_files_and_chunk
-from src.store import build_or_update_indices, load_indices, DocChunk, load_docstore
-from src.hybrid import hybrid_retrieve
-from src.rerank import maybe_rerank
-from src.generate import get_generator
-from src.graph import build_graph, RAGState
 from src.utils import timer, fmt_citation
+from src.telemetry import inc, set_attrs, trace
+# Indexing, FAISS, LangGraph and the LLM SDKs are imported where first used,
+# so the page renders before any of them load
 
 load_dotenv()
 st.set_page_config(page_title="RAG FAQ Bot", page_icon="❓", layout="wide")
@@ -32,13 +28,20 @@ if st.sidebar.button("Build / Update Index", use_container_width=True):
         status_text = st.sidebar.empty()
         
         try:
-            status_text.text("📄 Parsing files...")
-            progress_bar.progress(0.2)
-            texts = parse_files_and_chunk(st.session_state["uploaded_payloads"])
-            
-            status_text.text("🔍 Building search indices...")
-            progress_bar.progress(0.4)
-            build_or_update_indices(texts)
+            from src.pipeline import ingest
+            payloads = st.session_state["uploaded_payloads"]
+            stage_names = {"parse": "📄 Parsing files", "embed": "🧮 Embedding chunks", "index": "🔍 Updating indices"}
+            counts = {"parse": 0, "index": 0}
+
+            def on_progress(stage, done, total):
+                if stage in counts:
+                    counts[stage] = done
+                # Parsing and indexing each fill half of the bar
+                files = max(len(payloads), 1)
+                progress_bar.progress(min(1.0, (counts["parse"] + counts["index"]) / (2 * files)))
+                status_text.text(f"{stage_names[stage]}... {done}/{total}")
+
+            ingest(payloads, on_progress=on_progress)
             
             progress_bar.progress(1.0)
             status_text.text("✅ Index updated successfully!")
@@ -47,11 +50,18 @@ if st.sidebar.button("Build / Update Index", use_container_width=True):
             st.sidebar.error(f"Error: {str(e)}")
         finally:
             # Clean up progress indicators after 2 seconds
-            import time
             time.sleep(2)
             progress_bar.empty()
             status_text.empty()
 
+from src.store import delete_file, file_manifest
+indexed_files = sorted(file_manifest())
+if indexed_files:
+    to_delete = st.sidebar.selectbox("Indexed files", indexed_files)
+    if st.sidebar.button("Delete File From Index", use_container_width=True):
+        removed = delete_file(to_delete)
+        st.sidebar.success(f"Removed {removed} chunks of {to_delete}")
+
 st.sidebar.subheader("Retrieval Options")
 use_hybrid = st.sidebar.toggle("Use Hybrid Search (BM25 + Vector)", value=True)
 use_rerank = st.sidebar.toggle("Use Reranker", value=True)
@@ -65,49 +75,83 @@ st.caption("Upload your FAQ docs, build an index, then ask questions. See retrie
 question = st.text_input("Ask a question about your FAQs…", value="What is the refund policy?")
 ask = st.button("Ask", type="primary")
 
-cfg: AppConfig = load_app_config()
-gen = get_generator()
-
 if ask and question.strip():
-    faiss, bm25, docstore = load_indices()
-    graph = build_graph(use_hybrid, use_rerank)
-
-    with timer() as t:
-        result_state: RAGState = graph.invoke({
-            "question": question.strip(),
-            "retrieved_vector": [],
-            "retrieved_bm25": [],
-            "candidates": [],
-            "reranked": [],
-            "context": "",
-            "answer": "",
-            "citations": [],
-            "config": {
-                "topk_vec": topk_vec,
-                "topk_bm25": topk_bm25,
-                "topk_after": topk_after,
-                "use_hybrid": use_hybrid,
-                "use_rerank": use_rerank,
-            }
-        })
-    st.markdown(f"**Answer:** {result_state['answer']}")
-    if result_state["citations"]:
-        st.markdown("**Citations:**")
-        for c in result_state["citations"]:
-            st.markdown(f"- {fmt_citation(c)}")
+    from src.answer_cache import lookup_answer
+    from src.graph import get_graph, initial_state, RAGState
+    question = question.strip()
+    config = {
+        "topk_vec": topk_vec,
+        "topk_bm25": topk_bm25,
+        "topk_after": topk_after,
+        "use_hybrid": use_hybrid,
+        "use_rerank": use_rerank,
+    }
+
+    result_state = None
+    ttft = []
+    with timer() as t, trace("ask", hybrid=use_hybrid, rerank=use_rerank) as tr:
+        # Same answer cache as the API: exact question, then a close embedding
+        cache, generation, query_vec, hit, tier = lookup_answer(question, config)
+        inc("rag_answers_total", cached=tier if hit is not None else "none", mode="ui")
+        set_attrs(cached=tier if hit is not None else None)
+        answer_box = st.container()
+        cites_box = st.container()
+        if hit is None:
+            graph = get_graph(use_hybrid, use_rerank)
+            result_state: RAGState = graph.invoke(initial_state(question, {**config, "stream": True}, query_vec))
+            citations = result_state["citations"]
+        else:
+            citations = hit["citations"]
+        # Citations come from the chosen chunks, so they show before the answer streams
+        if citations:
+            cites_box.markdown("**Citations:**")
+            for c in citations:
+                cites_box.markdown(f"- {fmt_citation(c)}")
+        answer_box.markdown("**Answer:**")
+
+        if hit is not None:
+            answer_box.markdown(hit["answer"])
+        else:
+            def tokens():
+                for tok in result_state["answer_stream"]:
+                    if not ttft:
+                        ttft.append((time.time() - t.start) * 1000)
+                    yield tok
+
+            result_state["answer"] = answer_box.write_stream(tokens())
+            if cache is not None:
+                cache.put(question, config, generation,
+                          {"answer": result_state["answer"], "citations": citations}, result_state["query_vec"])
 
     with st.expander("🔎 Debug: Retrieval Details"):
-        st.write("**Vector Results:**")
-        for d in result_state.get("retrieved_vector", [])[:20]:
-            st.code(f"[{d.score:.3f}] {d.meta['file_name']} :: {d.text[:220]}")
-        if use_hybrid:
-            st.write("**BM25 Results:**")
-            for d in result_state.get("retrieved_bm25", [])[:20]:
+        if result_state is None:
+            st.write(f"Answered from the answer cache ({tier} match); retrieval was skipped.")
+        else:
+            st.write("**Vector Results:**")
+            for d in result_state["retrieved_vector"].resolve(20):
+                st.code(f"[{d.score:.3f}] {d.meta['file_name']} :: {d.text[:220]}")
+            if use_hybrid:
+                st.write("**BM25 Results:**")
+                for d in result_state["retrieved_bm25"].resolve(20):
+                    st.code(f"[{d.score:.3f}] {d.meta['file_name']} :: {d.text[:220]}")
+            st.write("**Final Candidates (after merge/rerank):**")
+            for d in (result_state.get("reranked") or result_state["candidates"]).resolve(20):
                 st.code(f"[{d.score:.3f}] {d.meta['file_name']} :: {d.text[:220]}")
-        st.write("**Final Candidates (after merge/rerank):**")
-        for d in (result_state.get("reranked") or result_state.get("candidates"))[:20]:
-            st.code(f"[{d.score:.3f}] {d.meta['file_name']} :: {d.text[:220]}")
-    st.caption(f"Elapsed: {t.elapsed_ms:.0f} ms")
+    with st.expander("⏱️ Debug: Stage Timings"):
+        # Waterfall of the spans recorded for this question (graph nodes,
+        # embedding, rerank and LLM calls)
+        import altair as alt
+        import pandas as pd
+        rows = tr.waterfall()
+        bars = pd.DataFrame([{"span": "  " * r["depth"] + r["span"], "start_ms": r["start_ms"],
+                              "end_ms": r["start_ms"] + r["duration_ms"], "duration_ms": r["duration_ms"]} for r in rows])
+        st.altair_chart(alt.Chart(bars).mark_bar().encode(
+            x=alt.X("start_ms:Q", title="ms since question"), x2="end_ms:Q",
+            y=alt.Y("span:N", sort=None, title=None), tooltip=["span", "start_ms", "duration_ms"],
+        ), use_container_width=True)
+        st.dataframe(rows, use_container_width=True)
+    first = f" · first token: {ttft[0]:.0f} ms" if ttft else ""
+    st.caption(f"Elapsed: {t.elapsed_ms:.0f} ms{first}")
 
 else:
     st.info("Tip: try uploading the sample files in `data/samples/`, build the index, then ask.")
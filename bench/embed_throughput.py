@@ -0,0 +1,30 @@
+import argparse, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.stubs import StubServer
+
+def main():
+    ap = argparse.ArgumentParser(description="Embedding engine throughput against a local stub server")
+    ap.add_argument("--texts", type=int, default=2000)
+    ap.add_argument("--latency-ms", type=float, default=100)
+    ap.add_argument("--error-rate", type=float, default=0.05)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    args = ap.parse_args()
+
+    from src.embed_engine import EmbeddingEngine
+    texts = [f"Q: synthetic question number {i}?\nA: synthetic answer {i}." for i in range(args.texts)]
+    results = []
+    with StubServer(latency_ms=args.latency_ms, error_rate=args.error_rate) as stub:
+        for c in args.concurrency:
+            engine = EmbeddingEngine("openai", "stub", f"{stub.url}/v1", concurrency=c, batch_size=64)
+            start = time.perf_counter()
+            vecs = engine.embed("stub-model", texts)
+            elapsed = time.perf_counter() - start
+            assert len(vecs) == len(texts)
+            results.append({"concurrency": c, "seconds": round(elapsed, 3),
+                            "texts_per_s": round(len(texts) / elapsed, 1)})
+        results.append({"requests": stub.requests, "throttled": stub.throttled})
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse, csv, json, os, platform, random, resource, subprocess, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench.stubs import StubServer
+
+# End-to-end benchmark: for each corpus size a fresh process builds a
+# synthetic index through the real ingestion pipeline, then replays a
+# question set through every retrieval stage and the full graph. Embedding
+# and chat calls go to a local stub server. Output is one JSON document;
+# pass an earlier run as --baseline to flag regressions.
+
+SEED_FILES = ("train_expanded.csv", "data/samples/sample_faq.csv")
+
+def _seeds():
+    pairs = []
+    for name in SEED_FILES:
+        with open(os.path.join(ROOT, name), newline='', encoding='utf-8') as f:
+            pairs += [(r["question"], r["answer"]) for r in csv.DictReader(f) if r.get("question")]
+    return pairs
+
+def _write_corpus(dest: str, n: int, rows_per_file: int, rng: random.Random):
+    # Variants of the seed Q&A pairs with a few foreign words mixed in, so
+    # BM25 postings and vectors differ between copies
+    seeds = _seeds()
+    vocab = sorted({w for q, a in seeds for w in (q + " " + a).split() if w.isalpha()})
+    for f in range(0, n, rows_per_file):
+        with open(os.path.join(dest, f"synthetic_{f // rows_per_file:05d}.csv"), 'w', newline='', encoding='utf-8') as out:
+            w = csv.writer(out)
+            w.writerow(["question", "answer"])
+            for i in range(f, min(n, f + rows_per_file)):
+                q, a = seeds[i % len(seeds)]
+                extra = " ".join(rng.choice(vocab) for _ in range(4))
+                w.writerow([f"{q} ({extra})", f"{a} Ref {i}: {' '.join(rng.choice(vocab) for _ in range(8))}."])
+
+def _questions(n: int, rng: random.Random):
+    # Seed questions with one word dropped, like a user paraphrase
+    seeds = _seeds()
+    picked = rng.sample(seeds, n) if n <= len(seeds) else [rng.choice(seeds) for _ in range(n)]
+    out = []
+    for q, _ in picked:
+        words = q.split()
+        if len(words) > 3:
+            words.pop(rng.randrange(len(words)))
+        out.append(" ".join(words))
+    return out
+
+def _summary(samples_ms):
+    import numpy as np
+    if not samples_ms:
+        return {"n": 0}
+    a = np.asarray(samples_ms)
+    total_s = a.sum() / 1000
+    return {
+        "n": len(a),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p95_ms": round(float(np.percentile(a, 95)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+        "mean_ms": round(float(a.mean()), 3),
+        "throughput_qps": round(len(a) / total_s, 1) if total_s else None,
+    }
+
+def _timed(fn, items, warmup: int = 0):
+    # warmup calls (connection setup, first-use imports) are not recorded
+    for it in items[:warmup]:
+        fn(it)
+    out = []
+    for it in items:
+        t0 = time.perf_counter()
+        fn(it)
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1 << 20) if sys.platform == "darwin" else rss / 1024, 1)
+
+def run_size(n: int, args) -> dict:
+    rng = random.Random(args.seed)
+    work = tempfile.mkdtemp(prefix=f"rag_bench_{n}_")
+    corpus = os.path.join(work, "corpus")
+    os.makedirs(corpus)
+    _write_corpus(corpus, n, args.rows_per_file, rng)
+
+    with StubServer(latency_ms=args.latency_ms, dim=args.dim, token_ms=0) as stub:
+        store_dir = os.path.join(work, "store")
+        os.environ.update(
+            FAISS_PATH=f"{store_dir}/faiss.index", DOCSTORE_PATH=f"{store_dir}/docstore",
+            BM25_PATH=f"{store_dir}/bm25", GENERATION_PATH=f"{store_dir}/generation",
+            FAISS_REPORT_PATH=f"{store_dir}/index_report.json", EMBED_CACHE_DIR=f"{store_dir}/embed_cache",
+            ANSWER_CACHE_SIZE="0", EMBEDDING_PROVIDER="openai", API_PROVIDER="openai",
+            RERANK_PROVIDER="api", OPENAI_API_KEY="bench", OPENAI_BASE_URL=f"{stub.url}/v1",
+        )
+        import faiss
+        from src.graph import get_graph, initial_state
+        from src.hybrid import merge_candidates
+        from src.pipeline import ingest
+        from src.rerank import maybe_rerank
+        from src.store import bm25_search, embed_queries, faiss_search, load_indices
+        from src.vector_index import all_vectors, index_kind, search_params
+
+        files = sorted(os.path.join(corpus, f) for f in os.listdir(corpus))
+        t0 = time.perf_counter()
+        stats = ingest(files, workers=args.ingest_workers)
+        build_s = time.perf_counter() - t0
+
+        k = args.k
+        questions = _questions(args.queries, rng)
+        vecs = embed_queries(questions)
+        index, _, _ = load_indices()
+        result = {
+            "chunks": int(index.ntotal),
+            "index_type": index_kind(index),
+            "build": {"seconds": round(build_s, 3), "chunks_per_s": round(stats["chunks"] / build_s, 1),
+                      "files": stats["files"], "batches": stats["batches"]},
+            "stages": {},
+        }
+
+        # Recall of the configured index against exact search on the same vectors
+        all_vecs, ids = all_vectors(index)
+        flat = faiss.IndexFlatIP(all_vecs.shape[1])
+        flat.add(all_vecs)
+        _, truth = flat.search(vecs, k)
+        _, got = index.search(vecs, k, params=search_params(index))
+        hits = sum(len(set(ids[t].tolist()) & set(g.tolist())) for t, g in zip(truth, got))
+        result["recall_at_k"] = {"k": k, "recall": round(hits / (k * len(questions)), 4)}
+
+        stages = result["stages"]
+        order = list(range(len(questions)))
+        stages["faiss_search"] = _summary(_timed(lambda i: faiss_search(questions[i], k, query_vec=vecs[i:i + 1]), order))
+        stages["bm25_search"] = _summary(_timed(lambda i: bm25_search(questions[i], k), order))
+
+        retrieved = [(faiss_search(q, k, query_vec=vecs[i:i + 1]), bm25_search(q, k)) for i, q in enumerate(questions)]
+        merged = [merge_candidates(v, b) for v, b in retrieved]
+        stages["merge_candidates"] = _summary(_timed(lambda i: merge_candidates(*retrieved[i]), order))
+
+        some = order[:args.llm_queries]
+        stages["maybe_rerank"] = _summary(_timed(lambda i: maybe_rerank(questions[i], merged[i], 5, True), some, warmup=1))
+        config = {"topk_vec": k, "topk_bm25": k, "topk_after": 5, "use_hybrid": True, "use_rerank": True}
+        graph = get_graph(True, True)
+        stages["graph"] = _summary(_timed(lambda i: graph.invoke(initial_state(questions[i], config)), some, warmup=1))
+        result["stub_requests"] = stub.requests
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+def _regressions(current: dict, baseline: dict, tolerance: float):
+    # Slower p95, lower throughput or recall beyond tolerance, per size/stage
+    found = []
+    base_sizes = {str(r["size"]): r for r in baseline.get("results", [])}
+    for r in current["results"]:
+        b = base_sizes.get(str(r["size"]))
+        if b is None:
+            continue
+        for stage, s in r["stages"].items():
+            bs = b["stages"].get(stage)
+            if not bs or not bs.get("n") or not s.get("n"):
+                continue
+            if s["p95_ms"] > bs["p95_ms"] * (1 + tolerance):
+                found.append({"size": r["size"], "stage": stage, "metric": "p95_ms", "baseline": bs["p95_ms"], "current": s["p95_ms"]})
+            if bs.get("throughput_qps") and (s.get("throughput_qps") or 0) < bs["throughput_qps"] * (1 - tolerance):
+                found.append({"size": r["size"], "stage": stage, "metric": "throughput_qps",
+                              "baseline": bs["throughput_qps"], "current": s["throughput_qps"]})
+        if r["recall_at_k"]["recall"] < b["recall_at_k"]["recall"] - 0.01:
+            found.append({"size": r["size"], "stage": "faiss", "metric": "recall",
+                          "baseline": b["recall_at_k"]["recall"], "current": r["recall_at_k"]["recall"]})
+        if r["build"]["seconds"] > b["build"]["seconds"] * (1 + tolerance):
+            found.append({"size": r["size"], "stage": "build", "metric": "seconds",
+                          "baseline": b["build"]["seconds"], "current": r["build"]["seconds"]})
+    return found
+
+def main():
+    ap = argparse.ArgumentParser(description="Latency, throughput, memory and recall benchmark on synthetic corpora")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--llm-queries", type=int, default=50, help="questions sent through rerank and the full graph")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--latency-ms", type=float, default=5, help="stub server latency per request")
+    ap.add_argument("--rows-per-file", type=int, default=500)
+    ap.add_argument("--ingest-workers", type=int, default=None)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="", help="write the JSON report here instead of stdout")
+    ap.add_argument("--baseline", default="", help="earlier report to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    ap.add_argument("--one", type=int, default=0, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.one:
+        print(json.dumps(run_size(args.one, args)))
+        return
+
+    # One process per size, so peak RSS and warm caches don't carry over
+    results = []
+    for n in args.sizes:
+        print(f"size {n}...", file=sys.stderr, flush=True)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--one", str(n)],
+                              stdout=subprocess.PIPE, check=True, cwd=ROOT)
+        results.append({"size": n, **json.loads(proc.stdout.decode().strip().splitlines()[-1])})
+
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, cwd=ROOT).stdout.decode().strip()
+    report = {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "one")},
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            report["regressions"] = _regressions(report, json.load(f), args.tolerance)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if report.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse, json, os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start check: each module is imported in a fresh interpreter. It fails
+# when an import takes longer than its budget (ms, interpreter startup
+# excluded) or pulls in a library that should only load on first use.
+
+HEAVY = ("faiss", "openai", "groq", "pypdf", "torch", "sentence_transformers")
+NETWORK = ("httpx", "requests")
+GRAPH = ("langgraph", "langchain_core")
+
+BUDGETS = {
+    # module: (budget_ms, modules that must not be loaded)
+    "src.config": (60, HEAVY + NETWORK + GRAPH + ("numpy",)),
+    "src.ingestion": (80, HEAVY + NETWORK + GRAPH + ("numpy",)),
+    "src.store": (250, HEAVY + NETWORK + GRAPH),
+    "src.hybrid": (250, HEAVY + NETWORK + GRAPH),
+    "src.rerank": (300, HEAVY + NETWORK + GRAPH),
+    "src.generate": (300, HEAVY + NETWORK + GRAPH),
+    "src.pipeline": (300, HEAVY + NETWORK + GRAPH),
+    "src.service": (1200, HEAVY),
+    "src.api": (1500, HEAVY),
+}
+
+PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import {module}
+ms = (time.perf_counter() - t) * 1000
+print(json.dumps({{"ms": ms, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+def _slowest(module: str, n: int = 8):
+    # Third-party packages by cumulative import time (python -X importtime)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, cwd=ROOT)
+    rows = []
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if "." not in name and name != "src" and name not in sys.stdlib_module_names:
+            rows.append((int(cumulative), name))
+    return [{"module": name, "ms": round(us / 1000, 1)} for us, name in sorted(rows, reverse=True)[:n]]
+
+def measure(module: str, forbidden, repeat: int):
+    best, loaded = None, []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", PROBE.format(module=module, forbidden=tuple(forbidden))],
+                              stdout=subprocess.PIPE, check=True, cwd=ROOT)
+        out = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+        best = out["ms"] if best is None else min(best, out["ms"])
+        loaded = out["loaded"]
+    return round(best, 1), loaded
+
+def main():
+    ap = argparse.ArgumentParser(description="Check import time and lazy loading of the src modules")
+    ap.add_argument("modules", nargs="*", default=list(BUDGETS))
+    ap.add_argument("--repeat", type=int, default=3, help="fresh interpreters per module; the fastest counts")
+    ap.add_argument("--scale", type=float, default=1.0, help="multiply every budget (slow CI machines)")
+    args = ap.parse_args()
+
+    results, failed = [], False
+    for module in args.modules:
+        budget, forbidden = BUDGETS.get(module, (float("inf"), HEAVY))
+        ms, loaded = measure(module, forbidden, args.repeat)
+        ok = ms <= budget * args.scale and not loaded
+        failed |= not ok
+        row = {"module": module, "ms": ms, "budget_ms": budget * args.scale, "eager_imports": loaded, "ok": ok}
+        if not ok:
+            row["slowest"] = _slowest(module)
+        results.append(row)
+    print(json.dumps({"python": sys.version.split()[0], "results": results}, indent=2))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse, csv, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay a question CSV through the batched RAG pipeline")
+    ap.add_argument("csv", nargs="?", default="train_expanded.csv")
+    ap.add_argument("--column", default="question")
+    ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--batch-size", type=int, default=256)
+    ap.add_argument("--workers", type=int, default=0)
+    ap.add_argument("--no-hybrid", action="store_true")
+    ap.add_argument("--no-rerank", action="store_true")
+    ap.add_argument("--out", default="", help="write one JSON line per question")
+    args = ap.parse_args()
+
+    from src.batch import answer_batch
+    with open(args.csv, newline='', encoding='utf-8') as f:
+        questions = [row[args.column] for row in csv.DictReader(f) if row.get(args.column)]
+    if args.limit:
+        questions = questions[:args.limit]
+
+    out = open(args.out, 'w', encoding='utf-8') if args.out else None
+    start = time.perf_counter()
+    for i in range(0, len(questions), args.batch_size):
+        results = answer_batch(questions[i:i + args.batch_size], use_hybrid=not args.no_hybrid,
+                               use_rerank=not args.no_rerank, workers=args.workers or None)
+        if out:
+            for r in results:
+                out.write(json.dumps({"question": r["question"], "answer": r["answer"],
+                                      "citations": r["citations"]}, ensure_ascii=False) + "\n")
+    elapsed = time.perf_counter() - start
+    if out:
+        out.close()
+    print(json.dumps({"questions": len(questions), "seconds": round(elapsed, 3),
+                      "questions_per_s": round(len(questions) / elapsed, 1) if elapsed else None}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+from typing import Optional
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import hashlib, json, random, threading, time
+import numpy as np
+
+# Local stand-ins for the OpenAI / HuggingFace HTTP APIs so benchmarks measure
+# our client code and not the network. Point OPENAI_BASE_URL or HF_API_URL at
+# StubServer.url (e.g. f"{url}/v1" and f"{url}/models").
+
+def _fake_vector(text: str, dim: int):
+    seed = int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+    v = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+class StubServer:
+    def __init__(self, latency_ms: float = 50, per_item_ms: float = 0.0, dim: int = 384,
+                 error_rate: float = 0.0, port: int = 0, token_ms: float = 5.0):
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.per_item_ms = per_item_ms
+        self.dim = dim
+        self.error_rate = error_rate
+        self.requests = 0
+        self.throttled = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code: int, body, headers: Optional[dict] = None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, content: str):
+                # OpenAI-style SSE chunks, one word per event
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for i, word in enumerate(content.split(" ")):
+                    chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                             "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                          "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    time.sleep(stub.token_ms / 1000)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                stub.requests += 1
+                if stub.error_rate and random.random() < stub.error_rate:
+                    stub.throttled += 1
+                    return self._reply(429, {"error": "rate limited"}, {"Retry-After": "0.05"})
+                if self.path.endswith("/embeddings"):
+                    texts = body.get("input") or []
+                    time.sleep((stub.latency_ms + stub.per_item_ms * len(texts)) / 1000)
+                    data = [{"index": i, "embedding": _fake_vector(t, stub.dim)} for i, t in enumerate(texts)]
+                    return self._reply(200, {"data": data})
+                if self.path.endswith("/chat/completions"):
+                    time.sleep(stub.latency_ms / 1000)
+                    content = stub.chat_reply(body)
+                    if body.get("stream"):
+                        return self._stream(content)
+                    return self._reply(200, {"choices": [{"message": {"role": "assistant", "content": content}}]})
+                if "/models/" in self.path:
+                    texts = body.get("inputs") or []
+                    time.sleep((stub.latency_ms + stub.per_item_ms * len(texts)) / 1000)
+                    return self._reply(200, [_fake_vector(t, stub.dim) for t in texts])
+                self._reply(404, {"error": "not found"})
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def chat_reply(self, body) -> str:
+        prompt = body["messages"][-1]["content"]
+        # Reranking prompts list numbered passages; answer with one score each
+        n = sum(1 for line in prompt.splitlines() if line[:1].isdigit() and ". " in line[:6])
+        if n:
+            return ",".join(f"{random.random():.2f}" for _ in range(n))
+        return "This is a stub answer [1]."
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,233 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio, json, os, sqlite3, threading, time
+import numpy as np
+from src.config import load_app_config
+from src.index_manager import get_index_manager
+from src.store import embed_query, aembed_query
+from src.utils import hash_text, normalize_question
+
+# Two tiers in front of the RAG graph:
+#   exact     normalized question + retrieval options + index generation
+#   semantic  nearest cached query embedding (cosine >= threshold) among
+#             entries with the same options and generation
+# Entries live in memory and in SQLite so they survive restarts. A new index
+# generation invalidates everything cached against the old one.
+
+class _Entry:
+    __slots__ = ("key", "generation", "options", "answer", "vec", "created", "last_used")
+
+    def __init__(self, key, generation, options, answer, vec, created, last_used):
+        self.key = key
+        self.generation = generation
+        self.options = options
+        self.answer = answer
+        self.vec = vec
+        self.created = created
+        self.last_used = last_used
+
+def options_key(config: Dict[str, Any]) -> str:
+    return json.dumps(config, sort_keys=True)
+
+class AnswerCache:
+    def __init__(self, path: str, capacity: int, ttl: float, threshold: float):
+        self.path = path
+        self.capacity = capacity
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        self._touched = set()
+        # (generation, options) -> (keys, matrix) for the semantic tier
+        self._groups: Dict[Tuple[int, str], Tuple[List[str], np.ndarray]] = {}
+        self._generation: Optional[int] = None
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS answers (
+            key TEXT PRIMARY KEY, generation INTEGER, options TEXT, answer TEXT,
+            vec BLOB, created REAL, last_used REAL)""")
+        self._load()
+
+    def _load(self):
+        now = time.time()
+        rows = self._db.execute(
+            "SELECT key, generation, options, answer, vec, created, last_used FROM answers "
+            "WHERE created > ? ORDER BY last_used DESC LIMIT ?", (now - self.ttl, self.capacity)).fetchall()
+        for key, gen, opts, answer, vec, created, last_used in rows:
+            v = np.frombuffer(vec, dtype=np.float32) if vec else None
+            self._entries[key] = _Entry(key, gen, opts, json.loads(answer), v, created, last_used)
+
+    @staticmethod
+    def _key(question: str, options: str, generation: int) -> str:
+        return hash_text(f"{generation}\x00{options}\x00{normalize_question(question)}")
+
+    def _set_generation(self, generation: int) -> bool:
+        # Caller holds the lock. Generations only grow; a request that started
+        # on an older snapshot neither reads nor writes the cache.
+        if self._generation == generation:
+            return True
+        if self._generation is not None and generation < self._generation:
+            return False
+        self._generation = generation
+        stale = [k for k, e in self._entries.items() if e.generation != generation]
+        for k in stale:
+            del self._entries[k]
+        self._groups.clear()
+        self._touched.clear()
+        self._db.execute("DELETE FROM answers WHERE generation != ?", (generation,))
+        self._db.commit()
+        return True
+
+    def _live(self, e: Optional[_Entry], now: float) -> bool:
+        return e is not None and now - e.created <= self.ttl
+
+    def _hit(self, e: _Entry, now: float) -> Dict[str, Any]:
+        e.last_used = now
+        self._touched.add(e.key)
+        return e.answer
+
+    def get_exact(self, question: str, config: Dict[str, Any], generation: int) -> Optional[Dict[str, Any]]:
+        key = self._key(question, options_key(config), generation)
+        now = time.time()
+        with self._lock:
+            if not self._set_generation(generation):
+                return None
+            e = self._entries.get(key)
+            if self._live(e, now):
+                self.exact_hits += 1
+                return self._hit(e, now)
+        return None
+
+    def get_similar(self, query_vec: Optional[np.ndarray], config: Dict[str, Any], generation: int) -> Optional[Dict[str, Any]]:
+        # Counts a miss when nothing is close enough; call after get_exact.
+        # No vector (nothing indexed yet) is a plain miss.
+        opts = options_key(config)
+        q = np.asarray(query_vec if query_vec is not None else [], dtype=np.float32).reshape(-1)
+        now = time.time()
+        with self._lock:
+            if not len(q) or not self._set_generation(generation):
+                self.misses += 1
+                return None
+            group = self._groups.get((generation, opts))
+            if group is None:
+                keys = [k for k, e in self._entries.items()
+                        if e.options == opts and e.vec is not None and len(e.vec) == len(q)]
+                mat = np.vstack([self._entries[k].vec for k in keys]) if keys else np.zeros((0, len(q)), dtype=np.float32)
+                group = (keys, mat)
+                self._groups[(generation, opts)] = group
+            keys, mat = group
+            if len(keys):
+                sims = mat @ q
+                best = int(np.argmax(sims))
+                e = self._entries.get(keys[best])
+                if sims[best] >= self.threshold and self._live(e, now):
+                    self.semantic_hits += 1
+                    return self._hit(e, now)
+            self.misses += 1
+        return None
+
+    def put(self, question: str, config: Dict[str, Any], generation: int, answer: Dict[str, Any],
+            query_vec: Optional[np.ndarray] = None):
+        opts = options_key(config)
+        key = self._key(question, opts, generation)
+        vec = None if query_vec is None else np.asarray(query_vec, dtype=np.float32).reshape(-1).copy()
+        now = time.time()
+        with self._lock:
+            if not self._set_generation(generation):
+                return
+            self._entries[key] = _Entry(key, generation, opts, answer, vec, now, now)
+            self._groups.pop((generation, opts), None)
+            evicted = self._evict(now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, generation, opts, json.dumps(answer, ensure_ascii=False),
+                 vec.tobytes() if vec is not None else None, now, now))
+            if evicted:
+                self._db.executemany("DELETE FROM answers WHERE key = ?", [(k,) for k in evicted])
+            # LRU ticks from hits are persisted lazily, with the next write
+            touched = [(self._entries[k].last_used, k) for k in self._touched if k in self._entries]
+            self._db.executemany("UPDATE answers SET last_used = ? WHERE key = ?", touched)
+            self._touched.clear()
+            self._db.commit()
+
+    def _evict(self, now: float) -> List[str]:
+        # Caller holds the lock: drop expired entries, then least recently used
+        evicted = [k for k, e in self._entries.items() if now - e.created > self.ttl]
+        over = len(self._entries) - len(evicted) - self.capacity
+        if over > 0:
+            expired = set(evicted)
+            alive = sorted((e.last_used, k) for k, e in self._entries.items() if k not in expired)
+            evicted += [k for _, k in alive[:over]]
+        for k in evicted:
+            e = self._entries.pop(k)
+            self._groups.pop((e.generation, e.options), None)
+            self._touched.discard(k)
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self._touched.clear()
+            self._db.execute("DELETE FROM answers")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+_caches: Dict[str, AnswerCache] = {}
+_caches_lock = threading.Lock()
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    cfg = load_app_config()
+    if cfg.answer_cache_size <= 0:
+        return None
+    with _caches_lock:
+        cache = _caches.get(cfg.answer_cache_path)
+        if cache is None:
+            cache = AnswerCache(cfg.answer_cache_path, cfg.answer_cache_size,
+                                cfg.answer_cache_ttl, cfg.answer_cache_threshold)
+            _caches[cfg.answer_cache_path] = cache
+    return cache
+
+# Lookups in front of the graph, shared by the Streamlit app and the API.
+# Both return (cache, generation, query_vec, hit, tier); on a miss the query
+# vector doubles as the graph's, so the question is embedded once. An empty
+# store has nothing to search and needs no embedding key.
+
+def lookup_answer(question: str, config: Dict[str, Any]):
+    cache = get_answer_cache()
+    snap = get_index_manager().snapshot()
+    if cache is None:
+        return None, snap.generation, None, None, None
+    hit = cache.get_exact(question, config, snap.generation)
+    if hit is not None:
+        return cache, snap.generation, None, hit, "exact"
+    query_vec = embed_query(question) if snap.faiss is not None and snap.docs else None
+    return cache, snap.generation, query_vec, cache.get_similar(query_vec, config, snap.generation), "semantic"
+
+async def alookup_answer(question: str, config: Dict[str, Any]):
+    # Snapshot reloads and SQLite reads stay off the event loop
+    cache = await asyncio.to_thread(get_answer_cache)
+    snap = await asyncio.to_thread(get_index_manager().snapshot)
+    if cache is None:
+        return None, snap.generation, None, None, None
+    hit = await asyncio.to_thread(cache.get_exact, question, config, snap.generation)
+    if hit is not None:
+        return cache, snap.generation, None, hit, "exact"
+    query_vec = await aembed_query(question) if snap.faiss is not None and snap.docs else None
+    hit = await asyncio.to_thread(cache.get_similar, query_vec, config, snap.generation)
+    return cache, snap.generation, query_vec, hit, "semantic"
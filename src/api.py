@@ -0,0 +1,92 @@
+from typing import Any, Dict, List, Optional
+from contextlib import asynccontextmanager
+import asyncio, json
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from src.service import create_service
+from src.batch import answer_batch
+from src.telemetry import render_metrics
+
+# Run with: uvicorn src.api:app --host 0.0.0.0 --port 8000
+
+class AskRequest(BaseModel):
+    question: str = Field(min_length=1)
+    use_hybrid: bool = True
+    use_rerank: bool = True
+    topk_vec: int = Field(5, ge=1, le=50)
+    topk_bm25: int = Field(5, ge=1, le=50)
+    topk_after: int = Field(5, ge=1, le=50)
+
+class AskResponse(BaseModel):
+    answer: str
+    citations: List[Dict[str, Any]]
+    cached: Optional[str] = None  # "exact" | "semantic" when served from the answer cache
+    elapsed_ms: float
+
+class AskBatchRequest(BaseModel):
+    questions: List[str] = Field(min_length=1, max_length=5000)
+    use_hybrid: bool = True
+    use_rerank: bool = True
+    topk_vec: int = Field(5, ge=1, le=50)
+    topk_bm25: int = Field(5, ge=1, le=50)
+    topk_after: int = Field(5, ge=1, le=50)
+
+class BatchAnswer(BaseModel):
+    question: str
+    answer: str
+    citations: List[Dict[str, Any]]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    service = create_service()
+    await service.start()
+    app.state.service = service
+    yield
+    await service.close()
+
+app = FastAPI(title="Customer Support FAQ Bot", lifespan=lifespan)
+
+@app.post("/ask", response_model=AskResponse)
+async def ask(req: AskRequest):
+    if not req.question.strip():
+        raise HTTPException(status_code=400, detail="Question must not be empty")
+    try:
+        return await app.state.service.answer(**req.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+@app.post("/ask/stream")
+async def ask_stream(req: AskRequest):
+    # Server-sent events: `citations` first, then `token` deltas, then `done`
+    if not req.question.strip():
+        raise HTTPException(status_code=400, detail="Question must not be empty")
+
+    async def events():
+        try:
+            async for kind, data in app.state.service.answer_stream(**req.model_dump()):
+                payload = {"text": data} if kind == "token" else data
+                yield f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        except ValueError as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/ask_batch", response_model=List[BatchAnswer])
+async def ask_batch(req: AskBatchRequest):
+    # Bulk replays: batched retrieval, then a bounded rerank/generation pool
+    try:
+        results = await asyncio.to_thread(answer_batch, **req.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return [{"question": r["question"], "answer": r["answer"], "citations": r["citations"]} for r in results]
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", **(await asyncio.to_thread(app.state.service.stats))}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text exposition format
+    return render_metrics()
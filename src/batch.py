@@ -0,0 +1,42 @@
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from src.config import load_app_config
+from src.store import EMPTY, embed_queries, faiss_search_batch, bm25_search_batch, tokenize
+from src.hybrid import merge_candidates
+from src.rerank import maybe_rerank
+from src.generate import get_generator
+
+# Many questions at once: one embedding call, one FAISS matrix search and one
+# vectorized BM25 pass, then rerank + generation per question on a bounded
+# pool. Per-question results match what the graph produces.
+
+def retrieve_batch(questions: List[str], topk_vec: int = 5, topk_bm25: int = 5,
+                   use_hybrid: bool = True) -> List[Dict[str, Any]]:
+    if not questions:
+        return []
+    vec = faiss_search_batch(embed_queries(questions), topk_vec)
+    if use_hybrid:
+        bm = bm25_search_batch([tokenize(q) for q in questions], topk_bm25)
+    else:
+        bm = [EMPTY for _ in questions]
+    return [
+        {"question": q, "retrieved_vector": v, "retrieved_bm25": b, "candidates": merge_candidates(v, b)}
+        for q, v, b in zip(questions, vec, bm)
+    ]
+
+def answer_batch(questions: List[str], use_hybrid: bool = True, use_rerank: bool = True,
+                 topk_vec: int = 5, topk_bm25: int = 5, topk_after: int = 5,
+                 workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    retrieved = retrieve_batch(questions, topk_vec, topk_bm25, use_hybrid)
+    gen = get_generator()
+
+    def finish(r: Dict[str, Any]) -> Dict[str, Any]:
+        chosen = r["candidates"]
+        if use_rerank:
+            chosen = maybe_rerank(r["question"], chosen, topk_after, True)
+        out = gen(r["question"], chosen.resolve())
+        return {**r, "reranked": chosen if use_rerank else EMPTY, "answer": out["answer"], "citations": out["citations"]}
+
+    workers = workers or load_app_config().batch_workers
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+        return list(pool.map(finish, retrieved))
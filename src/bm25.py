@@ -0,0 +1,309 @@
+from typing import Dict, Iterable, List, Optional, Sequence
+from collections import Counter
+import json, os
+import numpy as np
+from src.utils import atomic_path
+
+# Inverted-index BM25 stored as immutable segments (one per ingest):
+#   seg_NNNNNN.npz  terms, term_ptr, post_docs, post_tf, doc_ids, doc_lens
+#   deleted.npy     tombstoned doc ids
+#   manifest.json   ordered segment list
+# Doc ids are the docstore ids. Statistics (df, lengths, N) are derived
+# in memory and updated incrementally as segments and deletes arrive.
+
+K1 = 1.5
+B = 0.75
+
+def tokenize(text: str) -> List[str]:
+    return text.lower().split()
+
+class _Segment:
+    __slots__ = ("name", "terms", "lookup", "term_ptr", "post_docs", "post_tf", "doc_ids", "doc_lens")
+
+    def __init__(self, name, terms, term_ptr, post_docs, post_tf, doc_ids, doc_lens):
+        self.name = name
+        self.terms = terms
+        self.lookup = {t: i for i, t in enumerate(terms)}
+        self.term_ptr = term_ptr
+        self.post_docs = post_docs
+        self.post_tf = post_tf
+        self.doc_ids = doc_ids
+        self.doc_lens = doc_lens
+
+    @classmethod
+    def build(cls, ids: Sequence[int], texts: Sequence[str], name: Optional[str] = None):
+        postings: Dict[str, List] = {}
+        lens = []
+        for doc_id, text in zip(ids, texts):
+            toks = tokenize(text)
+            lens.append(len(toks))
+            for term, tf in Counter(toks).items():
+                postings.setdefault(term, []).append((doc_id, tf))
+        terms = sorted(postings)
+        counts = [len(postings[t]) for t in terms]
+        term_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=term_ptr[1:])
+        flat = [p for t in terms for p in postings[t]]
+        post_docs = np.array([p[0] for p in flat], dtype=np.int32)
+        post_tf = np.array([p[1] for p in flat], dtype=np.int32)
+        return cls(name, terms, term_ptr, post_docs, post_tf,
+                   np.asarray(ids, dtype=np.int32), np.asarray(lens, dtype=np.int32))
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as z:
+            return cls(os.path.basename(path), z["terms"].tolist(), z["term_ptr"], z["post_docs"],
+                       z["post_tf"], z["doc_ids"], z["doc_lens"])
+
+    def save(self, path: str):
+        with atomic_path(path) as tmp:
+            with open(tmp, 'wb') as f:
+                np.savez(f, terms=np.array(self.terms, dtype=str), term_ptr=self.term_ptr,
+                         post_docs=self.post_docs, post_tf=self.post_tf,
+                         doc_ids=self.doc_ids, doc_lens=self.doc_lens)
+
+    def postings(self, term: str):
+        i = self.lookup.get(term)
+        if i is None:
+            return None
+        a, b = self.term_ptr[i], self.term_ptr[i + 1]
+        return self.post_docs[a:b], self.post_tf[a:b]
+
+class BM25Index:
+    def __init__(self):
+        self.segments: List[_Segment] = []
+        self.df: Dict[str, int] = {}
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.live = np.zeros(0, dtype=bool)
+        self.n_docs = 0
+        self.total_len = 0
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.n_docs if self.n_docs else 0.0
+
+    def _grow(self, size: int):
+        if size > len(self.doc_len):
+            cap = max(size, 2 * len(self.doc_len))
+            self.doc_len = np.concatenate([self.doc_len, np.zeros(cap - len(self.doc_len), dtype=np.int32)])
+            self.live = np.concatenate([self.live, np.zeros(cap - len(self.live), dtype=bool)])
+
+    def _add_segment(self, seg: _Segment):
+        self.segments.append(seg)
+        if not len(seg.doc_ids):
+            return
+        self._grow(int(seg.doc_ids.max()) + 1)
+        self.doc_len[seg.doc_ids] = seg.doc_lens
+        self.live[seg.doc_ids] = True
+        self.n_docs += len(seg.doc_ids)
+        self.total_len += int(seg.doc_lens.sum())
+        counts = np.diff(seg.term_ptr)
+        for term, c in zip(seg.terms, counts.tolist()):
+            self.df[term] = self.df.get(term, 0) + c
+
+    def add_documents(self, ids: Sequence[int], texts: Sequence[str]) -> _Segment:
+        seg = _Segment.build(ids, texts)
+        self._add_segment(seg)
+        return seg
+
+    def delete_documents(self, ids: Iterable[int]):
+        ids = np.asarray([i for i in ids if 0 <= i < len(self.live) and self.live[i]], dtype=np.int64)
+        if not len(ids):
+            return
+        for seg in self.segments:
+            hit = np.isin(seg.post_docs, ids)
+            if not hit.any():
+                continue
+            term_of = np.repeat(np.arange(len(seg.terms)), np.diff(seg.term_ptr))
+            for t, c in zip(*np.unique(term_of[hit], return_counts=True)):
+                term = seg.terms[t]
+                self.df[term] -= int(c)
+                if self.df[term] <= 0:
+                    del self.df[term]
+        self.live[ids] = False
+        self.n_docs -= len(ids)
+        self.total_len -= int(self.doc_len[ids].sum())
+
+    def idf(self, term: str) -> float:
+        df = self.df.get(term, 0)
+        return float(np.log1p((self.n_docs - df + 0.5) / (df + 0.5)))
+
+    def _matches(self, tokens: List[str]):
+        # Gather only the postings of the query terms, weight them in one
+        # vectorized pass and drop tombstoned docs
+        docs_parts, tf_parts, idf_parts = [], [], []
+        for term in set(tokens):
+            if term not in self.df:
+                continue
+            idf = self.idf(term)
+            for seg in self.segments:
+                p = seg.postings(term)
+                if p is None:
+                    continue
+                docs_parts.append(p[0])
+                tf_parts.append(p[1])
+                idf_parts.append(np.full(len(p[0]), idf, dtype=np.float32))
+        if not docs_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        docs = np.concatenate(docs_parts).astype(np.int64)
+        tf = np.concatenate(tf_parts).astype(np.float32)
+        idf = np.concatenate(idf_parts)
+        dl = self.doc_len[docs]
+        w = idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / (self.avgdl or 1.0)))
+        keep = self.live[docs]
+        return docs[keep], w[keep]
+
+    @staticmethod
+    def _select(docs: np.ndarray, scores: np.ndarray, k: int):
+        if len(docs) > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+            docs, scores = docs[part], scores[part]
+        order = np.argsort(-scores, kind="stable")
+        return docs[order], scores[order]
+
+    def top_k(self, tokens: List[str], k: int):
+        # Cost follows the matched postings, not the corpus size
+        docs, w = self._matches(tokens)
+        if not len(docs) or k <= 0:
+            return docs[:0], w[:0]
+        uniq, inv = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inv, weights=w).astype(np.float32)
+        return self._select(uniq, scores, k)
+
+    def top_k_batch(self, token_lists: List[List[str]], k: int):
+        # Score many queries at once: postings are keyed by (query, doc) so a
+        # single unique/bincount accumulates every query's scores
+        stride = max(len(self.live), 1)
+        keys, weights = [], []
+        for qi, tokens in enumerate(token_lists):
+            docs, w = self._matches(tokens)
+            keys.append(docs + qi * stride)
+            weights.append(w)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if not token_lists or k <= 0:
+            return [empty for _ in token_lists]
+        uniq, inv = np.unique(np.concatenate(keys), return_inverse=True)
+        scores = np.bincount(inv, weights=np.concatenate(weights)).astype(np.float32)
+        bounds = np.searchsorted(uniq, np.arange(len(token_lists) + 1) * stride)
+        out = []
+        for qi in range(len(token_lists)):
+            a, b = bounds[qi], bounds[qi + 1]
+            out.append(self._select(uniq[a:b] - qi * stride, scores[a:b], k) if b > a else empty)
+        return out
+
+    def get_scores(self, tokens: List[str]) -> np.ndarray:
+        # Dense scores for every doc id, kept for callers that need them all
+        scores = np.zeros(len(self.live), dtype=np.float32)
+        docs, w = self._matches(tokens)
+        np.add.at(scores, docs, w)
+        return scores
+
+    def _copy(self) -> "BM25Index":
+        idx = BM25Index()
+        idx.segments = list(self.segments)
+        idx.df = dict(self.df)
+        idx.doc_len = self.doc_len.copy()
+        idx.live = self.live.copy()
+        idx.n_docs = self.n_docs
+        idx.total_len = self.total_len
+        return idx
+
+    # --- persistence ---
+
+    @staticmethod
+    def _manifest(path: str) -> Dict:
+        mpath = os.path.join(path, "manifest.json")
+        if not os.path.exists(mpath):
+            return {"segments": [], "next_seg": 0}
+        with open(mpath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_manifest(path: str, manifest: Dict):
+        with atomic_path(os.path.join(path, "manifest.json")) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, "manifest.json"))
+
+    @classmethod
+    def load(cls, path: str, previous: Optional["BM25Index"] = None) -> "BM25Index":
+        # When `previous` holds a prefix of the manifest's segments, start
+        # from a copy of it and only read and fold in the new segments.
+        names = cls._manifest(path)["segments"]
+        held = [s.name for s in previous.segments] if previous is not None else []
+        if held and names[:len(held)] == held:
+            idx = previous._copy()
+            names = names[len(held):]
+        else:
+            idx = cls()
+        for name in names:
+            idx._add_segment(_Segment.load(os.path.join(path, name)))
+        dpath = os.path.join(path, "deleted.npy")
+        if os.path.exists(dpath):
+            idx.delete_documents(np.load(dpath, allow_pickle=False).tolist())
+        return idx
+
+    @classmethod
+    def append_segment(cls, path: str, ids: Sequence[int], texts: Sequence[str]):
+        # Writes one new segment; cost is proportional to the upload only
+        if not len(ids):
+            return
+        os.makedirs(path, exist_ok=True)
+        manifest = cls._manifest(path)
+        name = f"seg_{manifest['next_seg']:06d}.npz"
+        _Segment.build(ids, texts, name).save(os.path.join(path, name))
+        manifest["segments"].append(name)
+        manifest["next_seg"] += 1
+        cls._write_manifest(path, manifest)
+
+    @classmethod
+    def compact(cls, path: str):
+        # Merge every segment into one, dropping tombstoned docs, and clear
+        # the tombstone list. Works on the posting arrays, no re-tokenizing.
+        dpath = os.path.join(path, "deleted.npy")
+        idx = cls.load(path)
+        if not idx.segments or (len(idx.segments) == 1 and not os.path.exists(dpath)):
+            return
+        vocab = np.unique(np.concatenate([np.array(seg.terms, dtype=str) for seg in idx.segments]))
+        gids, docs, tfs, ids, lens = [], [], [], [], []
+        for seg in idx.segments:
+            local = np.searchsorted(vocab, np.array(seg.terms, dtype=str))
+            gids.append(np.repeat(local, np.diff(seg.term_ptr)))
+            docs.append(seg.post_docs)
+            tfs.append(seg.post_tf)
+            keep = idx.live[seg.doc_ids]
+            ids.append(seg.doc_ids[keep])
+            lens.append(seg.doc_lens[keep])
+        gids, docs, tfs = np.concatenate(gids), np.concatenate(docs), np.concatenate(tfs)
+        keep = idx.live[docs]
+        gids, docs, tfs = gids[keep], docs[keep], tfs[keep]
+        order = np.lexsort((docs, gids))
+        gids, docs, tfs = gids[order], docs[order], tfs[order]
+        counts = np.bincount(gids, minlength=len(vocab))
+        used = counts > 0
+        term_ptr = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+        np.cumsum(counts[used], out=term_ptr[1:])
+
+        manifest = cls._manifest(path)
+        name = f"seg_{manifest['next_seg']:06d}.npz"
+        _Segment(name, vocab[used].tolist(), term_ptr, docs, tfs,
+                 np.concatenate(ids), np.concatenate(lens)).save(os.path.join(path, name))
+        old = manifest["segments"]
+        cls._write_manifest(path, {"segments": [name], "next_seg": manifest["next_seg"] + 1})
+        if os.path.exists(dpath):
+            os.remove(dpath)
+        for seg_name in old:
+            os.remove(os.path.join(path, seg_name))
+
+    @staticmethod
+    def mark_deleted(path: str, ids: Iterable[int]):
+        os.makedirs(path, exist_ok=True)
+        dpath = os.path.join(path, "deleted.npy")
+        old = np.load(dpath, allow_pickle=False) if os.path.exists(dpath) else np.zeros(0, dtype=np.int64)
+        merged = np.union1d(old, np.asarray(list(ids), dtype=np.int64))
+        with atomic_path(dpath) as tmp:
+            with open(tmp, 'wb') as f:
+                np.save(f, merged)
@@ -1,10 +1,11 @@
 import os
 from dataclasses import dataclass
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
 
-@dataclass
+@dataclass(frozen=True)
 class AppConfig:
     api_provider: str
     embedding_provider: str
@@ -13,10 +14,64 @@ class AppConfig:
     hf_token: str
     embed_model: str
     rerank_model: str
+    gen_model: str
+    context_tokens: int
+    context_dedupe: float
+    rerank_provider: str
+    rerank_threads: int
+    rerank_batch_size: int
+    rerank_max_length: int
+    rerank_budget_ms: float
+    rerank_cache_size: int
+    rerank_concurrency: int
+    rerank_group_tokens: int
+    rerank_group_size: int
+    rerank_passage_tokens: int
     faiss_path: str
     docstore_path: str
     bm25_path: str
+    generation_path: str
+    embed_cache_dir: str
+    embed_cache_size: int
+    answer_cache_path: str
+    answer_cache_size: int
+    answer_cache_ttl: float
+    answer_cache_threshold: float
+    openai_base_url: str
+    hf_api_url: str
+    embed_concurrency: int
+    embed_batch_tokens: int
+    embed_batch_size: int
+    embed_max_retries: int
+    local_embed_threads: int
+    local_embed_batch_size: int
+    local_embed_backend: str
+    faiss_index_type: str
+    faiss_auto_hnsw_min: int
+    faiss_auto_ivfpq_min: int
+    faiss_nlist: int
+    faiss_pq_m: int
+    faiss_hnsw_m: int
+    faiss_ef_construction: int
+    faiss_ef_search: int
+    faiss_nprobe: int
+    faiss_report_path: str
+    compact_dead_ratio: float
+    api_workers: int
+    batch_workers: int
+    ingest_workers: int
+    ingest_batch_chunks: int
+    chunk_strategy: str
+    chunk_tokens: int
+    chunk_overlap_tokens: int
+    trace_log_path: str
+    fusion_method: str
+    fusion_weights: tuple
+    fusion_rrf_k: int
 
+# One immutable snapshot per process, read from the environment on first
+# use; the hot path calls load_app_config() freely
+@lru_cache(maxsize=1)
 def load_app_config() -> 'AppConfig':
     return AppConfig(
         api_provider=os.getenv("API_PROVIDER", "groq"),
@@ -26,7 +81,64 @@ def load_app_config() -> 'AppConfig':
         hf_token=os.getenv("HF_TOKEN", ""),
         embed_model=os.getenv("EMBED_MODEL", "text-embedding-3-small"),
         rerank_model=os.getenv("RERANK_MODEL", "gpt-4o-mini"),
+        gen_model=os.getenv("GEN_MODEL", ""),
+        context_tokens=int(os.getenv("CONTEXT_TOKENS", "1500")),
+        context_dedupe=float(os.getenv("CONTEXT_DEDUPE", "0.85")),
+        rerank_provider=os.getenv("RERANK_PROVIDER", "api"),
+        rerank_threads=int(os.getenv("RERANK_THREADS", str(os.cpu_count() or 1))),
+        rerank_batch_size=int(os.getenv("RERANK_BATCH_SIZE", "16")),
+        rerank_max_length=int(os.getenv("RERANK_MAX_LENGTH", "512")),
+        rerank_budget_ms=float(os.getenv("RERANK_BUDGET_MS", "0")),
+        rerank_cache_size=int(os.getenv("RERANK_CACHE_SIZE", "100000")),
+        rerank_concurrency=int(os.getenv("RERANK_CONCURRENCY", "8")),
+        rerank_group_tokens=int(os.getenv("RERANK_GROUP_TOKENS", "1500")),
+        rerank_group_size=int(os.getenv("RERANK_GROUP_SIZE", "8")),
+        rerank_passage_tokens=int(os.getenv("RERANK_PASSAGE_TOKENS", "300")),
         faiss_path=os.getenv("FAISS_PATH", ".rag_store/faiss.index"),
-        docstore_path=os.getenv("DOCSTORE_PATH", ".rag_store/docstore.json"),
-        bm25_path=os.getenv("BM25_PATH", ".rag_store/bm25.pkl"),
+        docstore_path=os.getenv("DOCSTORE_PATH", ".rag_store/docstore"),
+        bm25_path=os.getenv("BM25_PATH", ".rag_store/bm25"),
+        generation_path=os.getenv("GENERATION_PATH", ".rag_store/generation"),
+        embed_cache_dir=os.getenv("EMBED_CACHE_DIR", ".rag_store/embed_cache"),
+        embed_cache_size=int(os.getenv("EMBED_CACHE_SIZE", "50000")),
+        answer_cache_path=os.getenv("ANSWER_CACHE_PATH", ".rag_store/answer_cache.sqlite"),
+        answer_cache_size=int(os.getenv("ANSWER_CACHE_SIZE", "10000")),
+        answer_cache_ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+        answer_cache_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+        openai_base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        hf_api_url=os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models"),
+        embed_concurrency=int(os.getenv("EMBED_CONCURRENCY", "4")),
+        embed_batch_tokens=int(os.getenv("EMBED_BATCH_TOKENS", "8000")),
+        embed_batch_size=int(os.getenv("EMBED_BATCH_SIZE", "96")),
+        embed_max_retries=int(os.getenv("EMBED_MAX_RETRIES", "5")),
+        local_embed_threads=int(os.getenv("LOCAL_EMBED_THREADS", str(os.cpu_count() or 1))),
+        local_embed_batch_size=int(os.getenv("LOCAL_EMBED_BATCH_SIZE", "32")),
+        local_embed_backend=os.getenv("LOCAL_EMBED_BACKEND", "torch"),
+        faiss_index_type=os.getenv("FAISS_INDEX_TYPE", "auto"),
+        faiss_auto_hnsw_min=int(os.getenv("FAISS_AUTO_HNSW_MIN", "20000")),
+        faiss_auto_ivfpq_min=int(os.getenv("FAISS_AUTO_IVFPQ_MIN", "500000")),
+        faiss_nlist=int(os.getenv("FAISS_NLIST", "0")),
+        faiss_pq_m=int(os.getenv("FAISS_PQ_M", "16")),
+        faiss_hnsw_m=int(os.getenv("FAISS_HNSW_M", "32")),
+        faiss_ef_construction=int(os.getenv("FAISS_EF_CONSTRUCTION", "80")),
+        faiss_ef_search=int(os.getenv("FAISS_EF_SEARCH", "64")),
+        faiss_nprobe=int(os.getenv("FAISS_NPROBE", "16")),
+        faiss_report_path=os.getenv("FAISS_REPORT_PATH", ".rag_store/index_report.json"),
+        compact_dead_ratio=float(os.getenv("COMPACT_DEAD_RATIO", "0.2")),
+        api_workers=int(os.getenv("API_WORKERS", "64")),
+        batch_workers=int(os.getenv("BATCH_WORKERS", "8")),
+        ingest_workers=int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1))),
+        ingest_batch_chunks=int(os.getenv("INGEST_BATCH_CHUNKS", "256")),
+        chunk_strategy=os.getenv("CHUNK_STRATEGY", "auto"),
+        chunk_tokens=int(os.getenv("CHUNK_TOKENS", "300")),
+        chunk_overlap_tokens=int(os.getenv("CHUNK_OVERLAP_TOKENS", "30")),
+        trace_log_path=os.getenv("TRACE_LOG_PATH", ""),
+        fusion_method=os.getenv("FUSION_METHOD", "rrf"),
+        # one weight per retriever in graph order (vector, bm25); empty = equal
+        fusion_weights=tuple(float(w) for w in os.getenv("FUSION_WEIGHTS", "").split(",") if w.strip()),
+        fusion_rrf_k=int(os.getenv("FUSION_RRF_K", "60")),
     )
+
+def reload_app_config() -> 'AppConfig':
+    # For scripts and tests that change the environment after startup
+    load_app_config.cache_clear()
+    return load_app_config()
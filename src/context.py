@@ -0,0 +1,87 @@
+from typing import List, Optional, Set, Tuple
+import re
+from src.config import load_app_config
+from src.store import DocChunk
+from src.utils import approx_tokens
+
+# Builds the single prompt context the generator consumes: near-duplicate
+# chunks are dropped, then chunks are added in rank order, each trimmed to
+# its most question-relevant sentences so the whole fits the token budget.
+
+_SENTENCE = re.compile(r'(?<=[.!?])\s+|\n+')
+_WORD = re.compile(r'\w+')
+
+def _words(text: str) -> Set[str]:
+    return {w for w in _WORD.findall(text.lower()) if len(w) > 2}
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def dedupe(chunks: List[DocChunk], threshold: float) -> List[DocChunk]:
+    # Keeps the higher-ranked chunk of every near-identical pair
+    kept, kept_words = [], []
+    for c in chunks:
+        w = _words(c.text)
+        if any(_jaccard(w, k) >= threshold for k in kept_words):
+            continue
+        kept.append(c)
+        kept_words.append(w)
+    return kept
+
+def trim(text: str, question_words: Set[str], budget: int) -> str:
+    if approx_tokens(text) <= budget:
+        return text
+    sentences = [s.strip() for s in _SENTENCE.split(text) if s.strip()]
+    # Most overlap with the question first, earlier sentences on ties;
+    # the picked ones go back in their original order
+    order = sorted(range(len(sentences)), key=lambda i: (-len(_words(sentences[i]) & question_words), i))
+    picked, used = [], 0
+    for i in order:
+        n = approx_tokens(sentences[i])
+        if used + n <= budget:
+            picked.append(i)
+            used += n
+    if not picked:
+        return text[:max(0, budget * 4 - 1)]
+    return " ".join(sentences[i] for i in sorted(picked))
+
+# Below this a trimmed chunk is mostly noise; drop low-ranked chunks instead
+MIN_CHUNK_TOKENS = 64
+
+def _water_fill(need: List[int], budget: int) -> List[int]:
+    # Smallest requests are served first; whatever they don't use is shared
+    # evenly among the bigger ones
+    alloc, remaining = [0] * len(need), budget
+    for k, i in enumerate(sorted(range(len(need)), key=lambda i: need[i])):
+        alloc[i] = min(need[i], remaining // (len(need) - k))
+        remaining -= alloc[i]
+    return alloc
+
+def pack_context(question: str, chunks: List[DocChunk], budget: Optional[int] = None,
+                 dedupe_threshold: Optional[float] = None) -> Tuple[str, List[DocChunk]]:
+    # Returns the packed context and the chunks it cites, numbered [1]..[n]
+    cfg = load_app_config()
+    budget = cfg.context_tokens if budget is None else budget
+    threshold = cfg.context_dedupe if dedupe_threshold is None else dedupe_threshold
+    chunks = dedupe(chunks, threshold) if threshold < 1 else list(chunks)
+    labels = [f"[{i}] {c.meta.get('file_name')} :: " for i, c in enumerate(chunks, start=1)]
+    need = [approx_tokens(lab) + approx_tokens(c.text) for lab, c in zip(labels, chunks)]
+    while True:
+        alloc = _water_fill(need[:len(chunks)], budget)
+        # Drop the lowest-ranked chunk while any chunk would be cut to crumbs
+        starved = any(a < min(n, MIN_CHUNK_TOKENS) for a, n in zip(alloc, need))
+        if not starved or len(chunks) <= 1:
+            break
+        chunks = chunks[:-1]
+
+    qwords = _words(question)
+    lines, used = [], []
+    for lab, c, a in zip(labels, chunks, alloc):
+        text = trim(c.text, qwords, a - approx_tokens(lab))
+        if text:
+            used.append(c)
+            # Renumber in case an earlier chunk was dropped
+            lines.append(f"[{len(used)}] {c.meta.get('file_name')} :: {text}")
+    return "\n\n".join(lines), used
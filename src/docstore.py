@@ -0,0 +1,289 @@
+from typing import Any, Dict, Iterator, List, Optional
+import json, os
+import numpy as np
+from src.utils import atomic_path
+
+# Append-only binary docstore (a directory):
+#   records.bin  fixed-width rows, one per doc id: heap offset/length, flags, uid
+#   heap.bin     UTF-8 JSON {"text", "meta"} per doc, appended back to back
+#   uids.bin     open-addressing hash table uid -> doc id (linear probing)
+#   files.json   file_name -> {"version", "ids"} for per-file replace/delete,
+#                plus the ingest fingerprint {"sha1", "size", "parser"}
+#   reserved     next doc id already handed to FAISS/BM25 (see reserve)
+#   positions.json  doc id -> {"chunk_id", "page", "start", "end"} for rows
+#                whose chunk moved within its file since it was appended;
+#                merged into their meta on read, folded into the heap by compact
+# Readers memory-map the files as they were when opened, so rows appended
+# later are invisible to them until the index manager swaps snapshots.
+
+REC = np.dtype([('offset', '<u8'), ('length', '<u4'), ('flags', 'u1'), ('uid', 'S16')])
+SLOT = np.dtype([('key', '<u8'), ('id', '<i8')])
+TOMBSTONE = 1
+PURGED = 2  # tombstoned and already dropped from every index by compaction
+
+def _map(path: str, dtype, mode: str = 'r'):
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    n = size // np.dtype(dtype).itemsize
+    if not n:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=(n,))
+
+def _uid_key(uid: str) -> int:
+    # uids are 16 hex chars (64 bits of sha1); 0 marks an empty slot
+    return int(uid, 16) or 1
+
+class _UidMap:
+    def __init__(self, path: str):
+        self.path = path
+        self.table = _map(path, SLOT, 'r')
+
+    def get(self, uid: str) -> Optional[int]:
+        n = len(self.table)
+        if not n:
+            return None
+        key = _uid_key(uid)
+        i = key & (n - 1)
+        while True:
+            slot = self.table[i]
+            if slot['key'] == 0:
+                return None
+            if slot['key'] == key:
+                return int(slot['id'])
+            i = (i + 1) & (n - 1)
+
+    @staticmethod
+    def _insert(table, key: int, doc_id: int):
+        mask = len(table) - 1
+        i = key & mask
+        while table[i]['key'] not in (0, key):
+            i = (i + 1) & mask
+        table[i] = (key, doc_id)
+
+    @classmethod
+    def put_many(cls, path: str, uids: List[str], ids: List[int]):
+        if not uids:
+            return
+        table = _map(path, SLOT, 'r+')
+        used = int(np.count_nonzero(table['key'])) if len(table) else 0
+        if (used + len(uids)) * 2 > len(table):
+            # Rehash into a table at most half full, written beside the old one
+            cap = 1024
+            while cap < (used + len(uids)) * 2:
+                cap *= 2
+            new = np.zeros(cap, dtype=SLOT)
+            live = table[table['key'] != 0] if len(table) else table
+            for key, doc_id in zip(live['key'].tolist(), live['id'].tolist()):
+                cls._insert(new, key, doc_id)
+            for uid, doc_id in zip(uids, ids):
+                cls._insert(new, _uid_key(uid), doc_id)
+            del table
+            with atomic_path(path) as tmp:
+                new.tofile(tmp)
+            return
+        for uid, doc_id in zip(uids, ids):
+            cls._insert(table, _uid_key(uid), doc_id)
+        table.flush()
+
+class DocStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.records = _map(os.path.join(path, "records.bin"), REC)
+        self.heap = _map(os.path.join(path, "heap.bin"), np.uint8)
+        self._uids = _UidMap(os.path.join(path, "uids.bin"))
+        self._positions = DocStore.read_positions(path)
+        self._dead: Optional[int] = None
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, "records.bin"))
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        rec = self.records[i]
+        off, n = int(rec['offset']), int(rec['length'])
+        body = json.loads(self.heap[off:off + n].tobytes())
+        meta = body["meta"]
+        moved = self._positions.get(int(i))
+        if moved is not None:
+            meta = {**meta, **moved}
+        return {"text": body["text"], "meta": meta, "id": int(i), "uid": rec['uid'].decode()}
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    # Rows not deleted; purged rows have no body left to read
+    def live(self) -> Iterator[Dict[str, Any]]:
+        for i in np.flatnonzero((self.records['flags'] & TOMBSTONE) == 0).tolist():
+            yield self[i]
+
+    def lookup_uid(self, uid: str) -> Optional[int]:
+        return self._uids.get(uid)
+
+    def uid(self, i: int) -> str:
+        return self.records[i]['uid'].decode()
+
+    # Tombstones are flipped in place, so they apply to open snapshots too
+    def is_live(self, i: int) -> bool:
+        return not (int(self.records[i]['flags']) & TOMBSTONE)
+
+    # Tombstones still waiting for compaction; counted once per snapshot
+    # (deletes always bump the generation, which opens a new DocStore)
+    def dead_count(self) -> int:
+        if self._dead is None:
+            self._dead = len(self.dead_ids())
+        return self._dead
+
+    def dead_ids(self) -> np.ndarray:
+        if not len(self.records):
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero((self.records['flags'] & (TOMBSTONE | PURGED)) == TOMBSTONE)
+
+    @staticmethod
+    def mark_deleted(path: str, ids: List[int]):
+        if not ids:
+            return
+        records = _map(os.path.join(path, "records.bin"), REC, 'r+')
+        records['flags'][np.asarray(ids, dtype=np.int64)] |= TOMBSTONE
+        records.flush()
+
+    @staticmethod
+    def compact(path: str):
+        # Rewrite the heap without dead bodies. Ids stay stable: dead rows
+        # keep their slot with an empty body and drop out of the uid map.
+        old = DocStore(path)
+        if not old.dead_count():
+            return
+        recs = np.array(old.records)
+        live = np.flatnonzero((recs['flags'] & TOMBSTONE) == 0)
+        heap = bytearray()
+        for i in live.tolist():
+            off, n = int(recs[i]['offset']), int(recs[i]['length'])
+            if i in old._positions:
+                d = old[i]
+                body = json.dumps({"text": d["text"], "meta": d["meta"]}, ensure_ascii=False).encode('utf-8')
+                recs['length'][i] = len(body)
+            else:
+                body = old.heap[off:off + n].tobytes()
+            recs['offset'][i] = len(heap)
+            heap += body
+        dead = (recs['flags'] & TOMBSTONE) != 0
+        recs['offset'][dead] = 0
+        recs['length'][dead] = 0
+        recs['flags'][dead] |= PURGED
+        del old
+        with atomic_path(os.path.join(path, "heap.bin")) as tmp:
+            with open(tmp, 'wb') as f:
+                f.write(heap)
+        with atomic_path(os.path.join(path, "records.bin")) as tmp:
+            recs.tofile(tmp)
+        uids_path = os.path.join(path, "uids.bin")
+        if os.path.exists(uids_path):
+            os.remove(uids_path)
+        _UidMap.put_many(uids_path, [recs[i]['uid'].decode() for i in live.tolist()], live.tolist())
+        # Folded into the heap above; reapplying them is harmless meanwhile
+        positions_path = os.path.join(path, "positions.json")
+        if os.path.exists(positions_path):
+            os.remove(positions_path)
+
+    @staticmethod
+    def read_positions(path: str) -> Dict[int, Dict[str, Any]]:
+        fpath = os.path.join(path, "positions.json")
+        if not os.path.exists(fpath):
+            return {}
+        with open(fpath, 'r', encoding='utf-8') as f:
+            return {int(k): v for k, v in json.load(f).items()}
+
+    @staticmethod
+    def set_positions(path: str, moved: Dict[int, Dict[str, Any]]):
+        # Rows keep their vector and postings; only where they sit changes
+        if not moved:
+            return
+        positions = DocStore.read_positions(path)
+        positions.update(moved)
+        with atomic_path(os.path.join(path, "positions.json")) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({str(k): v for k, v in positions.items()}, f, ensure_ascii=False)
+
+    @staticmethod
+    def has_files(path: str) -> bool:
+        return os.path.exists(os.path.join(path, "files.json"))
+
+    @staticmethod
+    def read_files(path: str) -> Dict[str, Dict[str, Any]]:
+        fpath = os.path.join(path, "files.json")
+        if not os.path.exists(fpath):
+            return {}
+        with open(fpath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def write_files(path: str, files: Dict[str, Dict[str, Any]]):
+        os.makedirs(path, exist_ok=True)
+        with atomic_path(os.path.join(path, "files.json")) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(files, f, ensure_ascii=False)
+
+    @staticmethod
+    def append(path: str, docs: List[Dict[str, Any]]):
+        # docs carry "id" (== current length + position) and "uid"
+        if not docs:
+            return
+        os.makedirs(path, exist_ok=True)
+        heap_path = os.path.join(path, "heap.bin")
+        offset = os.path.getsize(heap_path) if os.path.exists(heap_path) else 0
+        recs = np.zeros(len(docs), dtype=REC)
+        with open(heap_path, 'ab') as heap:
+            for k, d in enumerate(docs):
+                body = json.dumps({"text": d["text"], "meta": d["meta"]}, ensure_ascii=False).encode('utf-8')
+                heap.write(body)
+                recs[k] = (offset, len(body), 0, d["uid"].encode())
+                offset += len(body)
+            heap.flush()
+            os.fsync(heap.fileno())
+        # Rows go in after their heap bytes, the uid map last
+        with open(os.path.join(path, "records.bin"), 'ab') as f:
+            f.write(recs.tobytes())
+        named = [d for d in docs if d["uid"]]
+        _UidMap.put_many(os.path.join(path, "uids.bin"), [d["uid"] for d in named], [d["id"] for d in named])
+
+    # Ids handed to FAISS and BM25 ahead of their docstore rows. Above
+    # len(store) only if a write failed part way; those ids are never reused.
+    @staticmethod
+    def reserved(path: str) -> int:
+        try:
+            with open(os.path.join(path, "reserved"), 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    @staticmethod
+    def reserve(path: str, next_id: int):
+        os.makedirs(path, exist_ok=True)
+        with atomic_path(os.path.join(path, "reserved")) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(str(next_id))
+
+class LegacyDocs(list):
+    # docstore.json written by earlier versions: read-only, nothing deleted
+    def is_live(self, i: int) -> bool:
+        return True
+
+    def uid(self, i: int) -> str:
+        return self[i].get("uid", "")
+
+    def live(self) -> Iterator[Dict[str, Any]]:
+        return iter(self)
+
+    def dead_count(self) -> int:
+        return 0
+
+def load_legacy_json(path: str) -> LegacyDocs:
+    # Kept readable until the next build migrates it
+    legacy = f"{path}.json"
+    if not os.path.exists(legacy):
+        return LegacyDocs()
+    with open(legacy, 'r', encoding='utf-8') as f:
+        return LegacyDocs(json.load(f))
@@ -0,0 +1,201 @@
+from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+import os, threading
+import numpy as np
+from numpy.lib.format import open_memmap
+from src.config import load_app_config
+from src.utils import hash_text
+
+try:
+    import fcntl
+except ImportError:  # Windows: no file locks, keep one process per cache dir
+    fcntl = None
+
+# On-disk layout per (provider, model), memory-mapped and shared by every
+# process using the directory (API server, bulk ingest):
+#   vectors.f32  float32 matrix (capacity x dim)
+#   keys.npy     S16 text hash per slot (b"" = free)
+#   ticks.npy    int64 last-use tick per slot, for LRU eviction
+#   state.npy    int64 [version, clock, used]; version moves on every store
+#                so other processes know to re-read the key table
+#   lock         flock: shared for lookups, exclusive for stores
+# Entries are written in place; a store touches only its own slots.
+
+VERSION, CLOCK, USED = 0, 1, 2
+FILES = ("vectors.f32", "keys.npy", "ticks.npy", "state.npy")
+
+class EmbeddingCache:
+    def __init__(self, root: str, provider: str, model: str, capacity: int):
+        self.dir = os.path.join(root, hash_text(f"{provider}:{model}"))
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._ticks: Optional[np.memmap] = None
+        self._state: Optional[np.memmap] = None
+        self._slots: Dict[bytes, int] = {}
+        self._seen = -1
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.dir, exist_ok=True)
+        self._lock_fd = os.open(self._path("lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked(exclusive=True):
+            self._open()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        # The thread lock first: flock is per open file, shared by our threads
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _open(self):
+        # Exclusive lock held
+        if self._vectors is not None or not os.path.exists(self._path("keys.npy")):
+            return
+        keys = open_memmap(self._path("keys.npy"), mode='r+')
+        ticks = open_memmap(self._path("ticks.npy"), mode='r+')
+        n = len(keys)
+        dim = os.path.getsize(self._path("vectors.f32")) // (4 * n) if n else 0
+        if not dim:
+            return
+        vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode='r+', shape=(n, dim))
+        if n != self.capacity:
+            # Capacity changed: keep the most recently used entries. Files
+            # are replaced, not truncated, so other processes' maps stay valid.
+            keep = [i for i in np.argsort(-ticks) if keys[i]][:self.capacity]
+            vecs = np.array(vectors[keep]) if keep else np.zeros((0, dim), dtype=np.float32)
+            kept_keys, kept_ticks = np.array(keys[keep]), np.array(ticks[keep])
+            del vectors, keys, ticks
+            for name in FILES:
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self._create(dim)
+            self._vectors[:len(keep)] = vecs
+            self._ticks[:len(keep)] = kept_ticks
+            self._state[CLOCK] = int(kept_ticks.max()) if len(keep) else 0
+            self._state[USED] = len(keep)
+            self._vectors.flush()
+            self._keys[:len(keep)] = kept_keys
+            return
+        self._vectors, self._keys, self._ticks = vectors, keys, ticks
+        if os.path.exists(self._path("state.npy")):
+            self._state = open_memmap(self._path("state.npy"), mode='r+')
+        else:
+            # Cache written before the shared layout: slots were filled in order
+            filled = np.flatnonzero(keys != b"")
+            self._state = open_memmap(self._path("state.npy"), mode='w+', dtype=np.int64, shape=(3,))
+            self._state[CLOCK] = int(ticks.max()) if n else 0
+            self._state[USED] = int(filled.max()) + 1 if len(filled) else 0
+
+    def _create(self, dim: int):
+        # keys.npy last: other processes treat it as "the cache exists"
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode='w+', shape=(self.capacity, dim))
+        self._ticks = open_memmap(self._path("ticks.npy"), mode='w+', dtype=np.int64, shape=(self.capacity,))
+        self._state = open_memmap(self._path("state.npy"), mode='w+', dtype=np.int64, shape=(3,))
+        self._keys = open_memmap(self._path("keys.npy"), mode='w+', dtype='S16', shape=(self.capacity,))
+
+    def _sync(self):
+        # Re-read the key table only when another process stored since
+        version = int(self._state[VERSION])
+        if version != self._seen:
+            filled = np.flatnonzero(self._keys != b"")
+            self._slots = dict(zip(self._keys[filled].tolist(), filled.tolist()))
+            self._seen = version
+
+    def _touch(self) -> int:
+        # Shared LRU clock; racing increments under a shared lock only blur
+        # the order slightly
+        self._state[CLOCK] += 1
+        return int(self._state[CLOCK])
+
+    def lookup(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        found: List[Optional[np.ndarray]] = [None] * len(texts)
+        misses = []
+        if self._vectors is None and os.path.exists(self._path("keys.npy")):
+            with self._locked(exclusive=True):
+                self._open()
+        with self._locked(exclusive=False):
+            if self._vectors is not None:
+                self._sync()
+            for i, t in enumerate(texts):
+                key = hash_text(t).encode()
+                slot = self._slots.get(key)
+                # A slot may have been reused by another process since _sync
+                if slot is None or self._keys[slot] != key:
+                    misses.append(i)
+                    continue
+                self._ticks[slot] = self._touch()
+                found[i] = np.array(self._vectors[slot])
+            self.hits += len(texts) - len(misses)
+            self.misses += len(misses)
+        return found, misses
+
+    def store(self, texts: List[str], vecs: np.ndarray):
+        if not len(texts):
+            return
+        with self._locked(exclusive=True):
+            self._open()
+            if self._vectors is None:
+                self._create(vecs.shape[1])
+            if vecs.shape[1] != self._vectors.shape[1]:
+                return
+            self._sync()
+            slots, evicted = [], False
+            for t in texts:
+                key = hash_text(t).encode()
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot, old = self._free_slot()
+                    if old:
+                        # Unmapped before its vector changes, so a crash
+                        # can't leave the old key on a new vector
+                        self._slots.pop(old, None)
+                        self._keys[slot] = b""
+                        evicted = True
+                    self._slots[key] = slot
+                slots.append((slot, key))
+            if evicted:
+                self._keys.flush()
+            for (slot, _), v in zip(slots, vecs):
+                self._vectors[slot] = v
+            self._vectors.flush()
+            for slot, key in slots:
+                self._keys[slot] = key
+                self._ticks[slot] = self._touch()
+            self._state[VERSION] += 1
+            self._seen = int(self._state[VERSION])
+
+    def _free_slot(self) -> Tuple[int, bytes]:
+        # (slot, key it held); empty slots first, then least recently used
+        used = int(self._state[USED])
+        if used < self.capacity:
+            self._state[USED] = used + 1
+            return used, b""
+        slot = int(np.argmin(self._ticks))
+        # Not picked again within this store
+        self._ticks[slot] = self._touch()
+        return slot, bytes(self._keys[slot])
+
+_caches: Dict[Tuple[str, str, str, int], EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(provider: str, model: str) -> Optional[EmbeddingCache]:
+    cfg = load_app_config()
+    if cfg.embed_cache_size <= 0:
+        return None
+    key = (cfg.embed_cache_dir, provider, model, cfg.embed_cache_size)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = EmbeddingCache(cfg.embed_cache_dir, provider, model, cfg.embed_cache_size)
+            _caches[key] = cache
+    return cache
@@ -0,0 +1,174 @@
+from typing import TYPE_CHECKING, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, random, threading, time
+from src.config import load_app_config
+from src.utils import approx_tokens
+
+if TYPE_CHECKING:
+    import httpx
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# requests / httpx load with the first engine, i.e. when an API embedding
+# provider is actually used
+
+class EmbeddingEngine:
+    def __init__(self, provider: str, api_key: str, base_url: str, concurrency: int = 4,
+                 batch_tokens: int = 8000, batch_size: int = 96, max_retries: int = 5,
+                 timeout: float = 120):
+        self.provider = provider
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.base_url = base_url.rstrip('/')
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        import requests
+        from requests.adapters import HTTPAdapter
+        # One keep-alive pool shared by all workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+        self._aclient = None
+        self._aclient_loop = None
+
+    def batches(self, texts: List[str]) -> List[List[str]]:
+        out, cur, cur_tokens = [], [], 0
+        for t in texts:
+            n = approx_tokens(t)
+            if cur and (cur_tokens + n > self.batch_tokens or len(cur) >= self.batch_size):
+                out.append(cur)
+                cur, cur_tokens = [], 0
+            cur.append(t)
+            cur_tokens += n
+        if cur:
+            out.append(cur)
+        return out
+
+    def _payload(self, model: str, batch: List[str]):
+        if self.provider == "openai":
+            return f"{self.base_url}/embeddings", {"input": batch, "model": model}
+        return f"{self.base_url}/{model}", {"inputs": batch, "options": {"wait_for_model": True}}
+
+    def _request(self, model: str, batch: List[str]):
+        import requests
+        url, data = self._payload(model, batch)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(url, json=data, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self._backoff(attempt, None)
+                continue
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                self._backoff(attempt, response.headers.get("Retry-After"))
+                continue
+            response.raise_for_status()
+            return self._parse(response.json(), len(batch))
+
+    @staticmethod
+    def _delay(attempt: int, retry_after) -> float:
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = min(30.0, 0.5 * 2 ** attempt)
+        return delay + random.uniform(0, delay * 0.1)
+
+    def _backoff(self, attempt: int, retry_after):
+        time.sleep(self._delay(attempt, retry_after))
+
+    def _parse(self, result, n: int) -> List:
+        if self.provider == "openai":
+            items = sorted(result["data"], key=lambda item: item.get("index", 0))
+            return [item["embedding"] for item in items]
+        # HF returns list of embeddings for batch input
+        if not isinstance(result, list):
+            raise ValueError(f"Unexpected response format: {type(result)}")
+        if n == 1 and result and not isinstance(result[0], list):
+            # Single text returns single embedding
+            return [result]
+        return result
+
+    def embed(self, model: str, texts: List[str]) -> List:
+        # Batches run concurrently; results are reassembled in input order
+        futures = [self.pool.submit(self._request, model, b) for b in self.batches(texts)]
+        embeddings = []
+        for fut in futures:
+            embeddings.extend(fut.result())
+        return embeddings
+
+    def _async_client(self) -> "httpx.AsyncClient":
+        import httpx
+        # httpx clients are bound to the loop they were first used on
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient = httpx.AsyncClient(
+                headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                timeout=httpx.Timeout(self.timeout, pool=None),
+            )
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def aclose(self):
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+    async def _arequest(self, client: "httpx.AsyncClient", model: str, batch: List[str]):
+        import httpx
+        url, data = self._payload(model, batch)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.post(url, json=data)
+            except (httpx.ConnectError, httpx.TimeoutException):
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._delay(attempt, None))
+                continue
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                await asyncio.sleep(self._delay(attempt, response.headers.get("Retry-After")))
+                continue
+            response.raise_for_status()
+            return self._parse(response.json(), len(batch))
+
+    async def aembed(self, model: str, texts: List[str]) -> List:
+        # The connection limit bounds how many batches are in flight at once
+        client = self._async_client()
+        results = await asyncio.gather(*(self._arequest(client, model, b) for b in self.batches(texts)))
+        return [e for batch in results for e in batch]
+
+_engines: Dict[str, EmbeddingEngine] = {}
+_engines_lock = threading.Lock()
+
+async def aclose_embedding_engines():
+    for engine in list(_engines.values()):
+        await engine.aclose()
+
+def get_embedding_engine(provider: str) -> EmbeddingEngine:
+    cfg = load_app_config()
+    if provider == "openai":
+        api_key, base_url = cfg.openai_api_key, cfg.openai_base_url
+    else:
+        api_key, base_url = cfg.hf_token, cfg.hf_api_url
+    key = f"{provider}|{base_url}|{api_key}"
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = EmbeddingEngine(
+                provider, api_key, base_url,
+                concurrency=cfg.embed_concurrency,
+                batch_tokens=cfg.embed_batch_tokens,
+                batch_size=cfg.embed_batch_size,
+                max_retries=cfg.embed_max_retries,
+            )
+            _engines[key] = engine
+    return engine
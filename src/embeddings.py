@@ -1,37 +1,103 @@
 from typing import List
 import numpy as np
-import requests
 import json
+import asyncio
+import threading
 from src.config import load_app_config
+from src.embed_cache import get_embedding_cache
+from src.embed_engine import get_embedding_engine
+from src.telemetry import inc, span
+
+def _count(sp, provider: str, texts: int, hits: int, sent: int):
+    sp.set(texts=texts, cache_hits=hits, sent=sent)
+    inc("rag_embed_texts_total", hits, provider=provider, cache="hit")
+    inc("rag_embed_texts_total", texts - hits, provider=provider, cache="miss")
 
 def embed_texts(model_name: str, texts: List[str]):
     cfg = load_app_config()
-    
+    with span("embed_texts", provider=cfg.embedding_provider, model=model_name) as sp:
+        cache = get_embedding_cache(cfg.embedding_provider, model_name)
+        if cache is None:
+            _count(sp, cfg.embedding_provider, len(texts), 0, len(texts))
+            return _embed_uncached(cfg, model_name, texts)
+
+        # Only cache misses (deduplicated) go to the API
+        found, misses = cache.lookup(texts)
+        pending = list(dict.fromkeys(texts[i] for i in misses))
+        _count(sp, cfg.embedding_provider, len(texts), len(texts) - len(misses), len(pending))
+        if misses:
+            fresh = _embed_uncached(cfg, model_name, pending)
+            cache.store(pending, fresh)
+            by_text = dict(zip(pending, fresh))
+            for i in misses:
+                found[i] = by_text[texts[i]]
+        return np.vstack(found).astype(np.float32) if found else np.zeros((0, 0), dtype=np.float32)
+
+async def aembed_texts(model_name: str, texts: List[str]):
+    # Same as embed_texts, but API calls don't hold a thread while in flight
+    cfg = load_app_config()
+    with span("embed_texts", provider=cfg.embedding_provider, model=model_name) as sp:
+        cache = get_embedding_cache(cfg.embedding_provider, model_name)
+        if cache is None:
+            _count(sp, cfg.embedding_provider, len(texts), 0, len(texts))
+            return await _aembed_uncached(cfg, model_name, texts)
+
+        # Cache reads and writes touch disk and take a file lock: off the loop
+        found, misses = await asyncio.to_thread(cache.lookup, texts)
+        pending = list(dict.fromkeys(texts[i] for i in misses))
+        _count(sp, cfg.embedding_provider, len(texts), len(texts) - len(misses), len(pending))
+        if misses:
+            fresh = await _aembed_uncached(cfg, model_name, pending)
+            await asyncio.to_thread(cache.store, pending, fresh)
+            by_text = dict(zip(pending, fresh))
+            for i in misses:
+                found[i] = by_text[texts[i]]
+        return np.vstack(found).astype(np.float32) if found else np.zeros((0, 0), dtype=np.float32)
+
+_local_models = {}
+_local_lock = threading.Lock()
+
+def _load_local_model(cfg, model_name: str):
+    # Loaded once per process; later calls reuse the same weights
+    with _local_lock:
+        model = _local_models.get(model_name)
+        if model is None:
+            try:
+                import torch
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                raise ValueError("Local embeddings require sentence-transformers (pip install sentence-transformers)")
+            if cfg.local_embed_threads > 0:
+                torch.set_num_threads(cfg.local_embed_threads)
+            kwargs = {"device": "cpu"}
+            if cfg.local_embed_backend != "torch":
+                kwargs["backend"] = cfg.local_embed_backend
+            model = SentenceTransformer(model_name, **kwargs)
+            _local_models[model_name] = model
+    return model
+
+def _embed_local(cfg, model_name: str, texts: List[str]):
+    model = _load_local_model(cfg, model_name)
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    # Length-sorted batches keep padding (and wasted FLOPs) per batch small
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    out = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    bs = cfg.local_embed_batch_size
+    for start in range(0, len(order), bs):
+        idx = order[start:start + bs]
+        vecs = model.encode([texts[i] for i in idx], batch_size=len(idx),
+                            normalize_embeddings=True, convert_to_numpy=True)
+        out[idx] = vecs
+    return out
+
+def _embed_uncached(cfg, model_name: str, texts: List[str]):
     if cfg.embedding_provider == "openai":
         if not cfg.openai_api_key:
             raise ValueError("OpenAI API key is required for embeddings")
-        
-        headers = {
-            "Authorization": f"Bearer {cfg.openai_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "input": texts,
-            "model": model_name
-        }
-        
+        import requests
         try:
-            response = requests.post(
-                "https://api.openai.com/v1/embeddings",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            response.raise_for_status()
-            result = response.json()
-            embeddings = [item["embedding"] for item in result["data"]]
-            
+            embeddings = get_embedding_engine("openai").embed(model_name, texts)
         except requests.exceptions.RequestException as e:
             raise ValueError(f"OpenAI API error: {str(e)}")
         except (KeyError, json.JSONDecodeError) as e:
@@ -40,48 +106,10 @@ def embed_texts(model_name: str, texts: List[str]):
     elif cfg.embedding_provider == "huggingface":
         if not cfg.hf_token:
             raise ValueError("HuggingFace token is required for embeddings")
-        
-        headers = {
-            "Authorization": f"Bearer {cfg.hf_token}",
-            "Content-Type": "application/json"
-        }
-        
-        # HF API for embeddings - process texts in batches for speed
-        embeddings = []
-        batch_size = 10  # Process 10 texts at once
-        
+        import requests
+        # Token-budgeted batches sent concurrently over a pooled session
         try:
-            # Process in batches to reduce API calls from 200 to 20
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
-                
-                data = {
-                    "inputs": batch,
-                    "options": {"wait_for_model": True}
-                }
-                
-                response = requests.post(
-                    f"https://api-inference.huggingface.co/models/{model_name}",
-                    headers=headers,
-                    json=data,
-                    timeout=120
-                )
-                response.raise_for_status()
-                result = response.json()
-                
-                # HF returns list of embeddings for batch input
-                if isinstance(result, list):
-                    if len(batch) == 1:
-                        # Single text returns single embedding
-                        embeddings.append(result)
-                    else:
-                        # Multiple texts return list of embeddings
-                        embeddings.extend(result)
-                else:
-                    raise ValueError(f"Unexpected response format: {type(result)}")
-                
-            
-            
+            embeddings = get_embedding_engine("huggingface").embed(model_name, texts)
         except requests.exceptions.RequestException as e:
             error_msg = f"HuggingFace API error: {str(e)}"
             if hasattr(e, 'response') and e.response is not None:
@@ -94,9 +122,38 @@ def embed_texts(model_name: str, texts: List[str]):
         except (KeyError, json.JSONDecodeError) as e:
             raise ValueError(f"Invalid response from HuggingFace API: {str(e)}")
         
+    elif cfg.embedding_provider == "local":
+        # Already a normalized float32 matrix
+        return _embed_local(cfg, model_name, texts)
+
     else:
         raise ValueError(f"Unsupported embedding provider: {cfg.embedding_provider}")
-    
+
+    return _to_array(embeddings)
+
+async def _aembed_uncached(cfg, model_name: str, texts: List[str]):
+    if cfg.embedding_provider not in ("openai", "huggingface"):
+        # Local models are CPU-bound; keep them off the event loop
+        return await asyncio.to_thread(_embed_uncached, cfg, model_name, texts)
+
+    if cfg.embedding_provider == "openai":
+        name, key = "OpenAI", cfg.openai_api_key
+        if not key:
+            raise ValueError("OpenAI API key is required for embeddings")
+    else:
+        name, key = "HuggingFace", cfg.hf_token
+        if not key:
+            raise ValueError("HuggingFace token is required for embeddings")
+    import httpx
+    try:
+        embeddings = await get_embedding_engine(cfg.embedding_provider).aembed(model_name, texts)
+    except httpx.HTTPError as e:
+        raise ValueError(f"{name} API error: {str(e)}")
+    except (KeyError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid response from {name} API: {str(e)}")
+    return _to_array(embeddings)
+
+def _to_array(embeddings):
     # Convert to proper numpy array - handle nested structure from batching
     try:
         embeddings_array = np.array(embeddings, dtype=np.float32)
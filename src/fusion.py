@@ -0,0 +1,98 @@
+from typing import Callable, Dict, Optional, Sequence, Set, Tuple
+import logging
+import numpy as np
+from src.config import load_app_config
+
+logger = logging.getLogger(__name__)
+
+# Rank fusion over any number of retrievers. Each run is an (ids, scores)
+# pair of arrays, best first; inputs are never modified. Every method returns
+# new (ids, scores) arrays sorted by fused score, ties going to the document
+# with the better rank in any run.
+#   rrf       sum of w / (k + rank); ignores score scales entirely
+#   weighted  convex combination of per-run min-max normalized scores
+#   zscore    combination of per-run standardized scores; a document a run
+#             didn't return counts as that run's lowest score
+
+Run = Tuple[np.ndarray, np.ndarray]
+
+def _weights(n: int, weights: Optional[Sequence[float]]) -> np.ndarray:
+    if not weights:
+        return np.full(n, 1.0 / n) if n else np.zeros(0)
+    w = np.asarray(weights, dtype=np.float64)
+    if len(w) != n:
+        raise ValueError(f"Expected {n} fusion weights, got {len(w)}")
+    if (w < 0).any() or w.sum() <= 0:
+        raise ValueError("Fusion weights must be non-negative and not all zero")
+    return w / w.sum()
+
+def _union(runs: Sequence[Run]):
+    # Unique ids, each run's positions in that union, and the best rank
+    # any run gave each id (for tie-breaking)
+    all_ids = np.concatenate([np.asarray(ids, dtype=np.int64) for ids, _ in runs])
+    uniq, inverse = np.unique(all_ids, return_inverse=True)
+    best_rank = np.full(len(uniq), np.iinfo(np.int64).max, dtype=np.int64)
+    ranks = np.concatenate([np.arange(len(ids), dtype=np.int64) for ids, _ in runs])
+    np.minimum.at(best_rank, inverse, ranks)
+    bounds = np.cumsum([0] + [len(ids) for ids, _ in runs])
+    return uniq, [inverse[a:b] for a, b in zip(bounds[:-1], bounds[1:])], best_rank
+
+def _ranked(uniq: np.ndarray, fused: np.ndarray, best_rank: np.ndarray) -> Run:
+    order = np.lexsort((best_rank, -fused))
+    return uniq[order], fused[order].astype(np.float32)
+
+def rrf(runs: Sequence[Run], weights: Optional[Sequence[float]] = None, k: Optional[int] = None) -> Run:
+    k = load_app_config().fusion_rrf_k if k is None else k
+    uniq, pos, best = _union(runs)
+    fused = np.zeros(len(uniq))
+    for (ids, _), p, w in zip(runs, pos, _weights(len(runs), weights)):
+        fused += np.bincount(p, weights=w / (k + 1 + np.arange(len(ids))), minlength=len(uniq))
+    return _ranked(uniq, fused, best)
+
+def weighted(runs: Sequence[Run], weights: Optional[Sequence[float]] = None, k: Optional[int] = None) -> Run:
+    uniq, pos, best = _union(runs)
+    fused = np.zeros(len(uniq))
+    for (_, scores), p, w in zip(runs, pos, _weights(len(runs), weights)):
+        s = np.asarray(scores, dtype=np.float64)
+        if not len(s):
+            continue
+        lo, hi = s.min(), s.max()
+        norm = (s - lo) / (hi - lo) if hi > lo else np.ones_like(s)
+        fused += np.bincount(p, weights=w * norm, minlength=len(uniq))
+    return _ranked(uniq, fused, best)
+
+def zscore(runs: Sequence[Run], weights: Optional[Sequence[float]] = None, k: Optional[int] = None) -> Run:
+    uniq, pos, best = _union(runs)
+    fused = np.zeros(len(uniq))
+    for (_, scores), p, w in zip(runs, pos, _weights(len(runs), weights)):
+        s = np.asarray(scores, dtype=np.float64)
+        if not len(s):
+            continue
+        std = s.std()
+        z = (s - s.mean()) / std if std > 0 else np.zeros_like(s)
+        # Everyone starts at the run's floor; returned ids add their lift
+        fused += w * z.min()
+        fused += np.bincount(p, weights=w * (z - z.min()), minlength=len(uniq))
+    return _ranked(uniq, fused, best)
+
+FUSERS: Dict[str, Callable[..., Run]] = {"rrf": rrf, "weighted": weighted, "zscore": zscore}
+
+# (FUSION_WEIGHTS, run count) pairs already warned about
+_ignored: Set[Tuple[Tuple[float, ...], int]] = set()
+
+def fuse(runs: Sequence[Run], method: Optional[str] = None, weights: Optional[Sequence[float]] = None) -> Run:
+    cfg = load_app_config()
+    method = method or cfg.fusion_method
+    if method not in FUSERS:
+        raise ValueError(f"Unknown fusion method: {method} (expected {', '.join(FUSERS)})")
+    runs = list(runs)
+    if not runs or not any(len(ids) for ids, _ in runs):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    if weights is None and cfg.fusion_weights:
+        if len(cfg.fusion_weights) == len(runs):
+            weights = cfg.fusion_weights
+        elif (cfg.fusion_weights, len(runs)) not in _ignored:
+            _ignored.add((cfg.fusion_weights, len(runs)))
+            logger.warning("FUSION_WEIGHTS has %d weights for %d retrievers; ignoring it and weighting them equally",
+                           len(cfg.fusion_weights), len(runs))
+    return FUSERS[method](runs, weights)
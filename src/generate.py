@@ -1,6 +1,12 @@
-import os
-from typing import List, Dict
+import logging, re
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from src.config import load_app_config
+from src.llm import get_client, DEFAULT_CHAT_MODELS
 from src.store import DocChunk
+from src.context import pack_context
+from src.telemetry import inc, set_attrs, span
+
+logger = logging.getLogger(__name__)
 
 PROMPT = '''You are a helpful FAQ assistant. Use ONLY the provided context to answer.
 If the answer is not present, say: "I don't find this in the provided FAQs."
@@ -12,13 +18,7 @@ Context:
 
 Answer (be concise and reference the citations):'''
 
-def _format_context(chunks: List[DocChunk]):
-    lines = []
-    for i, c in enumerate(chunks, start=1):
-        lines.append(f"[{i}] {c.meta.get('file_name')} :: {c.text}")
-    return "\n\n".join(lines)
-
-def _citations_from(chunks: List[DocChunk]):
+def citations_from(chunks: List[DocChunk]):
     cites = []
     for i, c in enumerate(chunks, start=1):
         cites.append({
@@ -33,29 +33,158 @@ def _stub_generate(question: str, chunks: List[DocChunk]) -> Dict:
         return {"answer": "I don't find this in the provided FAQs.", "citations": []}
     top = chunks[0]
     answer = f"From {top.meta.get('file_name')}: {top.text[:300]}"
-    return {"answer": answer, "citations": _citations_from(chunks)}
-
-def generate_answer_openai(question: str, chunks: List[DocChunk]) -> Dict:
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        context = _format_context(chunks)
-        prompt = PROMPT.format(question=question, context=context)
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role":"user","content":prompt}],
-            temperature=0.1,
-        )
-        text = resp.choices[0].message.content.strip()
-        return {"answer": text, "citations": _citations_from(chunks)}
-    except Exception:
+    return {"answer": answer, "citations": citations_from(chunks)}
+
+def _packed(question: str, chunks: List[DocChunk], context: Optional[str]):
+    # (chunks, context): callers outside the graph hand over raw chunks
+    if context is None:
+        context, chunks = pack_context(question, chunks)
+    return chunks, context
+
+def _provider() -> str:
+    # API_PROVIDER when its key is set, else whichever key is set, else the stub
+    cfg = load_app_config()
+    keys = {"openai": cfg.openai_api_key, "groq": cfg.groq_api_key}
+    if keys.get(cfg.api_provider):
+        return cfg.api_provider
+    for provider in ("openai", "groq"):
+        if keys[provider]:
+            return provider
+    return "stub"
+
+def _request(provider: str, question: str, context: str) -> Dict:
+    prompt = PROMPT.format(question=question, context=context)
+    return {
+        "model": load_app_config().gen_model or DEFAULT_CHAT_MODELS[provider],
+        "messages": [{"role":"user","content":prompt}],
+        "temperature": 0.1,
+    }
+
+def _fallback(provider: str, reason: str, error: Optional[Exception] = None):
+    # The stub answer is a degraded result; count it and mark the span
+    inc("rag_generate_fallback_total", provider=provider, reason=reason)
+    set_attrs(fallback=reason)
+    if error is not None:
+        logger.warning("Generation with %s failed, answering with the stub: %s", provider, error)
+
+def _usage(provider: str, resp):
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return
+    set_attrs(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    inc("rag_llm_tokens_total", usage.prompt_tokens, provider=provider, kind="prompt")
+    inc("rag_llm_tokens_total", usage.completion_tokens, provider=provider, kind="completion")
+
+def _generate_with(provider: str, question: str, chunks: List[DocChunk], context: str) -> Dict:
+    request = _request(provider, question, context)
+    with span("llm.generate", provider=provider, model=request["model"], chunks=len(chunks)):
+        try:
+            resp = get_client(provider).chat.completions.create(**request)
+            _usage(provider, resp)
+            text = resp.choices[0].message.content.strip()
+            return {"answer": text, "citations": citations_from(chunks)}
+        except Exception as e:
+            _fallback(provider, "error", e)
+            return _stub_generate(question, chunks)
+
+async def _agenerate_with(provider: str, question: str, chunks: List[DocChunk], context: str) -> Dict:
+    request = _request(provider, question, context)
+    with span("llm.generate", provider=provider, model=request["model"], chunks=len(chunks)):
+        try:
+            client = get_client(provider, asynchronous=True)
+            resp = await client.chat.completions.create(**request)
+            _usage(provider, resp)
+            text = resp.choices[0].message.content.strip()
+            return {"answer": text, "citations": citations_from(chunks)}
+        except Exception as e:
+            _fallback(provider, "error", e)
+            return _stub_generate(question, chunks)
+
+def generate_answer_openai(question: str, chunks: List[DocChunk], context: Optional[str] = None) -> Dict:
+    return _generate_with("openai", question, *_packed(question, chunks, context))
+
+def generate_answer_groq(question: str, chunks: List[DocChunk], context: Optional[str] = None) -> Dict:
+    return _generate_with("groq", question, *_packed(question, chunks, context))
+
+async def agenerate_answer_openai(question: str, chunks: List[DocChunk], context: Optional[str] = None) -> Dict:
+    return await _agenerate_with("openai", question, *_packed(question, chunks, context))
+
+async def agenerate_answer_groq(question: str, chunks: List[DocChunk], context: Optional[str] = None) -> Dict:
+    return await _agenerate_with("groq", question, *_packed(question, chunks, context))
+
+def generate_answer_stub(question: str, chunks: List[DocChunk], context: Optional[str] = None) -> Dict:
+    with span("llm.generate", provider="stub", chunks=len(chunks)):
+        _fallback("stub", "no_api_key")
         return _stub_generate(question, chunks)
 
-def generate_answer_stub(question: str, chunks: List[DocChunk]) -> Dict:
-    return _stub_generate(question, chunks)
+async def agenerate_answer_stub(question: str, chunks: List[DocChunk], context: Optional[str] = None) -> Dict:
+    return generate_answer_stub(question, chunks, context)
 
 def get_generator():
-    if os.getenv("OPENAI_API_KEY"):
-        return generate_answer_openai
-    # (Add GROQ/TOGETHER similarly if desired)
-    return generate_answer_stub
+    return {"openai": generate_answer_openai, "groq": generate_answer_groq}.get(_provider(), generate_answer_stub)
+
+def get_async_generator():
+    return {"openai": agenerate_answer_openai, "groq": agenerate_answer_groq}.get(_provider(), agenerate_answer_stub)
+
+# Streaming: the same providers, yielding text deltas as they arrive. If the
+# provider fails (or sends nothing) before the first token, the stub answer is
+# streamed instead; after that an error just ends the stream.
+
+def _stub_tokens(question: str, chunks: List[DocChunk]) -> List[str]:
+    return re.findall(r"\S+\s*", _stub_generate(question, chunks)["answer"])
+
+def stream_answer(question: str, chunks: List[DocChunk], context: Optional[str] = None) -> Iterator[str]:
+    provider = _provider()
+    with span("llm.stream", provider=provider, chunks=len(chunks)) as sp:
+        deltas, error = 0, None
+        if provider == "stub":
+            _fallback(provider, "no_api_key")
+        else:
+            chunks, context = _packed(question, chunks, context)
+            try:
+                stream = get_client(provider).chat.completions.create(stream=True, **_request(provider, question, context))
+                for event in stream:
+                    delta = event.choices[0].delta.content if event.choices else None
+                    if delta:
+                        if not deltas:
+                            sp.set(first_token_ms=round(sp.duration_ms, 1))
+                        deltas += 1
+                        yield delta
+            except Exception as e:
+                error = e
+            sp.set(deltas=deltas)
+            if deltas:
+                if error is not None:
+                    sp.set(interrupted=str(error))
+                return
+            _fallback(provider, "error" if error else "empty", error)
+        yield from _stub_tokens(question, chunks)
+
+async def astream_answer(question: str, chunks: List[DocChunk], context: Optional[str] = None) -> AsyncIterator[str]:
+    provider = _provider()
+    with span("llm.stream", provider=provider, chunks=len(chunks)) as sp:
+        deltas, error = 0, None
+        if provider == "stub":
+            _fallback(provider, "no_api_key")
+        else:
+            chunks, context = _packed(question, chunks, context)
+            try:
+                client = get_client(provider, asynchronous=True)
+                stream = await client.chat.completions.create(stream=True, **_request(provider, question, context))
+                async for event in stream:
+                    delta = event.choices[0].delta.content if event.choices else None
+                    if delta:
+                        if not deltas:
+                            sp.set(first_token_ms=round(sp.duration_ms, 1))
+                        deltas += 1
+                        yield delta
+            except Exception as e:
+                error = e
+            sp.set(deltas=deltas)
+            if deltas:
+                if error is not None:
+                    sp.set(interrupted=str(error))
+                return
+            _fallback(provider, "error" if error else "empty", error)
+        for token in _stub_tokens(question, chunks):
+            yield token
@@ -1,79 +1,149 @@
-from typing import TypedDict, List, Dict
+from typing import TypedDict, List, Dict, Any
+from functools import lru_cache
+import asyncio
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, START, END
-from src.store import DocChunk
-from src.hybrid import hybrid_retrieve, merge_candidates
-from src.rerank import maybe_rerank
-from src.generate import get_generator
+from src.store import Candidates, DocChunk, EMPTY, embed_query, aembed_query, tokenize, faiss_search, bm25_search, load_indices
+from src.hybrid import merge_candidates
+from src.rerank import maybe_rerank, amaybe_rerank
+from src.context import pack_context
+from src.generate import get_generator, get_async_generator, stream_answer, astream_answer, citations_from
+from src.telemetry import set_attrs, traced
+from src.utils import approx_tokens
 
 class RAGState(TypedDict):
     question: str
-    retrieved_vector: List[DocChunk]
-    retrieved_bm25: List[DocChunk]
-    candidates: List[DocChunk]
-    reranked: List[DocChunk]
+    query_vec: Any
+    query_tokens: List[str]
+    retrieved_vector: Candidates
+    retrieved_bm25: Candidates
+    candidates: Candidates
+    reranked: Candidates
     context: str
+    context_chunks: List[DocChunk]
     answer: str
+    answer_stream: Any  # token iterator when config["stream"] is set
     citations: List[Dict]
     config: Dict
 
+# Nodes return only the keys they write so the vector and BM25 branches can
+# run in the same superstep without clobbering each other.
+
+def _has_vectors() -> bool:
+    idx, _, docs = load_indices()
+    return idx is not None and bool(docs)
+
+def _embed_query(state: RAGState):
+    # Callers may pass a vector they already computed (e.g. for caching)
+    if state.get("query_vec") is not None:
+        set_attrs(precomputed=True)
+        return {"query_vec": state["query_vec"]}
+    # Nothing to search yet: an empty store answers without an embedding key
+    if not _has_vectors():
+        set_attrs(skipped=True)
+        return {"query_vec": None}
+    return {"query_vec": embed_query(state["question"])}
+
+async def _aembed_query(state: RAGState):
+    if state.get("query_vec") is not None:
+        set_attrs(precomputed=True)
+        return {"query_vec": state["query_vec"]}
+    if not await asyncio.to_thread(_has_vectors):
+        set_attrs(skipped=True)
+        return {"query_vec": None}
+    return {"query_vec": await aembed_query(state["question"])}
+
+def _tokenize_query(state: RAGState):
+    tokens = tokenize(state["question"])
+    set_attrs(tokens=len(tokens))
+    return {"query_tokens": tokens}
+
 def _retrieve_vector(state: RAGState):
-    vec, _ = hybrid_retrieve(state["question"], state["config"]["topk_vec"], 0, False)
-    state["retrieved_vector"] = vec
-    return state
+    vec = faiss_search(state["question"], state["config"]["topk_vec"], state["query_vec"])
+    set_attrs(topk=state["config"]["topk_vec"], results=len(vec))
+    return {"retrieved_vector": vec}
 
 def _retrieve_bm25(state: RAGState):
-    _, bm = hybrid_retrieve(
-    state["question"],
-    state["config"]["topk_vec"],      # use correct value
-    state["config"]["topk_bm25"],
-    True
-)
-    state["retrieved_bm25"] = bm
-    return state
+    bm = bm25_search(state["question"], state["config"]["topk_bm25"], state["query_tokens"])
+    set_attrs(topk=state["config"]["topk_bm25"], results=len(bm))
+    return {"retrieved_bm25": bm}
 
 def _merge(state: RAGState):
-    vec = state.get("retrieved_vector") or []
-    bm = state.get("retrieved_bm25") or []
-    state["candidates"] = merge_candidates(vec, bm if state["config"].get("use_hybrid") else [])
-    return state
+    vec = state.get("retrieved_vector") or EMPTY
+    bm = state.get("retrieved_bm25") or EMPTY
+    candidates = merge_candidates(vec, bm if state["config"].get("use_hybrid") else EMPTY)
+    set_attrs(vector=len(vec), bm25=len(bm), candidates=len(candidates))
+    return {"candidates": candidates}
 
 def _rerank(state: RAGState):
-    cand = state.get("candidates") or []
-    state["reranked"] = maybe_rerank(state["question"], cand, state["config"]["topk_after"], state["config"].get("use_rerank"))
-    return state
+    cand = state.get("candidates") or EMPTY
+    reranked = maybe_rerank(state["question"], cand, state["config"]["topk_after"], state["config"].get("use_rerank"))
+    set_attrs(candidates=len(cand), kept=len(reranked))
+    return {"reranked": reranked}
+
+async def _arerank(state: RAGState):
+    cand = state.get("candidates") or EMPTY
+    reranked = await amaybe_rerank(state["question"], cand, state["config"]["topk_after"], state["config"].get("use_rerank"))
+    set_attrs(candidates=len(cand), kept=len(reranked))
+    return {"reranked": reranked}
 
 def _make_context(state: RAGState):
-    chosen = state.get("reranked") or state.get("candidates") or []
-    # Keep the topK already applied; context is join
-    ctx = []
-    for c in chosen:
-        ctx.append(f"{c.meta.get('file_name')} :: {c.text}")
-    state["context"] = "\n\n".join(ctx)
-    return state
+    # Ids and scores up to here; only the final candidates are read as chunks
+    chosen = (state.get("reranked") or state.get("candidates") or EMPTY).resolve()
+    # Deduped and trimmed to the token budget; the generator uses it as is
+    context, used = pack_context(state["question"], chosen)
+    set_attrs(chunks_in=len(chosen), chunks=len(used), tokens=approx_tokens(context))
+    return {"context": context, "context_chunks": used}
 
 def _generate(state: RAGState):
-    chosen = state.get("reranked") or state.get("candidates") or []
-    gen = get_generator()
-    out = gen(state["question"], chosen)
-    state["answer"] = out["answer"]
-    state["citations"] = out["citations"]
-    return state
+    chosen = state.get("context_chunks") or []
+    if state["config"].get("stream"):
+        # Citations are known before the first token; the caller drains the stream
+        stream = stream_answer(state["question"], chosen, state["context"])
+        return {"answer_stream": stream, "citations": citations_from(chosen)}
+    out = get_generator()(state["question"], chosen, state["context"])
+    return {"answer": out["answer"], "citations": out["citations"]}
+
+async def _agenerate(state: RAGState):
+    chosen = state.get("context_chunks") or []
+    if state["config"].get("stream"):
+        stream = astream_answer(state["question"], chosen, state["context"])
+        return {"answer_stream": stream, "citations": citations_from(chosen)}
+    out = await get_async_generator()(state["question"], chosen, state["context"])
+    return {"answer": out["answer"], "citations": out["citations"]}
+
+# Network-bound nodes get a native coroutine for ainvoke; invoke keeps the
+# sync path, and CPU-bound nodes run in the executor under ainvoke.
+# Every node runs inside a "graph.<node>" span.
+def _node(name: str, func, afunc=None):
+    if afunc is None:
+        return RunnableLambda(traced(f"graph.{name}")(func))
+    return RunnableLambda(traced(f"graph.{name}")(func), afunc=traced(f"graph.{name}")(afunc))
+
+_embed_node = _node("embed_query", _embed_query, _aembed_query)
+_rerank_node = _node("rerank_candidates", _rerank, _arerank)
+_generate_node = _node("generate_answer", _generate, _agenerate)
 
 def build_graph(use_hybrid: bool, use_rerank: bool):
     g = StateGraph(RAGState)
-    g.add_node("retrieve_vector", _retrieve_vector)
+    g.add_node("embed_query", _embed_node)
+    g.add_node("retrieve_vector", _node("retrieve_vector", _retrieve_vector))
     if use_hybrid:
-        g.add_node("retrieve_bm25", _retrieve_bm25)
-    g.add_node("merge_candidates", _merge)
+        g.add_node("tokenize_query", _node("tokenize_query", _tokenize_query))
+        g.add_node("retrieve_bm25", _node("retrieve_bm25", _retrieve_bm25))
+    g.add_node("merge_candidates", _node("merge_candidates", _merge))
     if use_rerank:
-        g.add_node("rerank_candidates", _rerank)
-    g.add_node("make_context", _make_context)
-    g.add_node("generate_answer", _generate)
+        g.add_node("rerank_candidates", _rerank_node)
+    g.add_node("make_context", _node("make_context", _make_context))
+    g.add_node("generate_answer", _generate_node)
 
-    g.add_edge(START, "retrieve_vector")
+    # Vector and BM25 retrieval are independent branches joined at merge
+    g.add_edge(START, "embed_query")
+    g.add_edge("embed_query", "retrieve_vector")
     if use_hybrid:
-        g.add_edge("retrieve_vector", "retrieve_bm25")
-        g.add_edge("retrieve_bm25", "merge_candidates")
+        g.add_edge(START, "tokenize_query")
+        g.add_edge("tokenize_query", "retrieve_bm25")
+        g.add_edge(["retrieve_vector", "retrieve_bm25"], "merge_candidates")
     else:
         g.add_edge("retrieve_vector", "merge_candidates")
     if use_rerank:
@@ -84,3 +154,25 @@ def build_graph(use_hybrid: bool, use_rerank: bool):
     g.add_edge("make_context", "generate_answer")
     g.add_edge("generate_answer", END)
     return g.compile()
+
+@lru_cache(maxsize=None)
+def get_graph(use_hybrid: bool, use_rerank: bool):
+    # Compiled graphs are stateless; compile each variant once per process
+    return build_graph(use_hybrid, use_rerank)
+
+def initial_state(question: str, config: Dict, query_vec=None) -> RAGState:
+    return {
+        "question": question,
+        "query_vec": query_vec,
+        "query_tokens": [],
+        "retrieved_vector": EMPTY,
+        "retrieved_bm25": EMPTY,
+        "candidates": EMPTY,
+        "reranked": EMPTY,
+        "context": "",
+        "context_chunks": [],
+        "answer": "",
+        "answer_stream": None,
+        "citations": [],
+        "config": config,
+    }
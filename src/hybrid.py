@@ -1,35 +1,30 @@
-from typing import List
-from src.store import faiss_search, bm25_search, DocChunk
+from typing import Optional
+from src.fusion import fuse
+from src.store import faiss_search, bm25_search, Candidates, EMPTY
 
 def hybrid_retrieve(question: str, topk_vec: int, topk_bm25: int, use_hybrid: bool):
-    vec = faiss_search(question, topk_vec) or []
-    bm = bm25_search(question, topk_bm25) if use_hybrid else []
+    vec = faiss_search(question, topk_vec)
+    bm = bm25_search(question, topk_bm25) if use_hybrid else EMPTY
     return vec, bm
 
-def merge_candidates(vec: List[DocChunk], bm: List[DocChunk]):
-    # Simple score normalization and union by (file_name, chunk_id)
-    def key(d): return (d.meta.get("file_name"), d.meta.get("chunk_id"))
-    merged = {}
-    # normalize vector to [0,1], bm25 to [0,1]
-    if vec:
-        v_scores = [d.score for d in vec]
-        v_min, v_max = min(v_scores), max(v_scores)
-    else:
-        v_min, v_max = 0.0, 1.0
-    if bm:
-        b_scores = [d.score for d in bm]
-        b_min, b_max = min(b_scores), max(b_scores)
-    else:
-        b_min, b_max = 0.0, 1.0
-    def norm(x, a, b):
-        return 0.5 if a==b else (x - a) / (b - a)
-    for d in vec:
-        merged[key(d)] = d
-        d.score = 0.5 + 0.5*norm(d.score, v_min, v_max)  # bias toward vector
-    for d in bm:
-        if key(d) in merged:
-            merged[key(d)].score = max(merged[key(d)].score, 0.5*norm(d.score, b_min, b_max))
-        else:
-            d.score = 0.5*norm(d.score, b_min, b_max)
-            merged[key(d)] = d
-    return sorted(list(merged.values()), key=lambda x: x.score, reverse=True)
+def _rebase(run: Candidates, docs) -> Candidates:
+    # The index was swapped between two retrievals: re-key the run by chunk
+    # uid against the other snapshot, dropping chunks it no longer has
+    lookup = getattr(docs, "lookup_uid", None)
+    ids, scores = [], []
+    for i, s in zip(run.ids.tolist(), run.scores.tolist()):
+        j = lookup(run.docs[i].get("uid")) if lookup else None
+        if j is not None and j < len(docs) and docs.is_live(j):
+            ids.append(j)
+            scores.append(s)
+    return Candidates(ids, scores, docs)
+
+def merge_candidates(*runs: Candidates, method: Optional[str] = None) -> Candidates:
+    # Fuses any number of ranked runs (vector, bm25, ...) by docstore id
+    # (see src/fusion.py); the inputs are left as they are
+    docs = next((r.docs for r in runs if len(r)), None)
+    if docs is None:
+        return EMPTY
+    runs = [r if not len(r) or r.docs is docs else _rebase(r, docs) for r in runs]
+    ids, scores = fuse([(r.ids, r.scores) for r in runs], method)
+    return Candidates(ids, scores, docs)
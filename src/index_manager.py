@@ -0,0 +1,176 @@
+from typing import Any, Dict, Optional, Tuple
+from dataclasses import dataclass
+from contextlib import contextmanager
+import os, threading, time
+from src.config import load_app_config
+from src.bm25 import BM25Index
+from src.docstore import DocStore, load_legacy_json
+from src.vector_index import read_index
+
+# The generation file works like a seqlock: writers bump it to an odd value
+# before touching any artifact and to the next even value once all of them
+# are in place. Readers only accept a snapshot whose generation was even and
+# unchanged across the whole load, so they never see a half-updated set.
+# A writer holds an flock on "<generation>.lock" for as long as the value is
+# odd. An odd generation nobody holds the lock for was left by a writer that
+# died (killed, OOM, failed compaction); readers then load the files as they
+# are, which is the last complete write since docstore rows go in last.
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, an odd generation is trusted for a while
+    fcntl = None
+
+WRITER_TIMEOUT_S = 300.0
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    faiss: Any
+    bm25: Any
+    docs: Any  # DocStore (or a list for a not yet migrated store)
+    generation: int
+    signature: Tuple
+
+def _read_generation(path: str) -> int:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def _write_generation(path: str, gen: int):
+    d = os.path.dirname(path)
+    if d and not os.path.exists(d):
+        os.makedirs(d, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(str(gen))
+    os.replace(tmp, path)
+
+def _writer_alive(path: str) -> bool:
+    if fcntl is None:
+        try:
+            return time.time() - os.path.getmtime(path) < WRITER_TIMEOUT_S
+        except FileNotFoundError:
+            return False
+    try:
+        fd = os.open(f"{path}.lock", os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)  # also drops the shared lock if we got it
+    return False
+
+@contextmanager
+def generation_write(generation_path: Optional[str] = None):
+    path = generation_path or load_app_config().generation_path
+    d = os.path.dirname(path)
+    if d and not os.path.exists(d):
+        os.makedirs(d, exist_ok=True)
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        gen = _read_generation(path)
+        if gen % 2:
+            gen += 1  # a previous writer died mid-update
+        _write_generation(path, gen + 1)
+        yield gen + 2
+        # Published only when the whole body went through. After a failure
+        # the generation stays odd, and with the lock released readers know
+        # nobody is still writing.
+        _write_generation(path, gen + 2)
+    finally:
+        os.close(fd)
+
+class IndexManager:
+    def __init__(self, faiss_path: str, docstore_path: str, bm25_path: str, generation_path: str,
+                 max_retries: int = 50, retry_wait: float = 0.05):
+        self.faiss_path = faiss_path
+        self.docstore_path = docstore_path
+        self.bm25_path = bm25_path
+        self.generation_path = generation_path
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self._lock = threading.Lock()
+        self._snapshot: Optional[IndexSnapshot] = None
+
+    def _signature(self) -> Tuple:
+        mtimes = []
+        bm25_files = (os.path.join(self.bm25_path, "manifest.json"), os.path.join(self.bm25_path, "deleted.npy"))
+        for p in (self.faiss_path, os.path.join(self.docstore_path, "records.bin"), *bm25_files):
+            try:
+                st = os.stat(p)
+                mtimes.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                mtimes.append(None)
+        return (_read_generation(self.generation_path), *mtimes)
+
+    def _load(self, sig: Tuple) -> IndexSnapshot:
+        faiss_idx = None
+        if os.path.exists(self.faiss_path):
+            faiss_idx = read_index(self.faiss_path)
+        if DocStore.exists(self.docstore_path):
+            docs = DocStore(self.docstore_path)
+        else:
+            docs = load_legacy_json(self.docstore_path)
+        bm25 = None
+        if BM25Index.exists(self.bm25_path):
+            prev = self._snapshot.bm25 if self._snapshot is not None else None
+            bm25 = BM25Index.load(self.bm25_path, previous=prev)
+        elif docs:
+            # Store written before segmented BM25: index the docstore in memory
+            bm25 = BM25Index()
+            live = list(docs.live())
+            bm25.add_documents([d["id"] for d in live], [d["text"] for d in live])
+        return IndexSnapshot(faiss_idx, bm25, docs, sig[0], sig)
+
+    def snapshot(self) -> IndexSnapshot:
+        # Fast path: a stat of each artifact, no deserialization
+        snap = self._snapshot
+        sig = self._signature()
+        if snap is not None and (snap.signature == sig or sig[0] % 2):
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            for _ in range(self.max_retries):
+                sig = self._signature()
+                if snap is not None and snap.signature == sig:
+                    return snap
+                if sig[0] % 2 and _writer_alive(self.generation_path):
+                    # Writer in progress: keep serving the old snapshot if we have one
+                    if snap is not None:
+                        return snap
+                    time.sleep(self.retry_wait)
+                    continue
+                loaded = self._load(sig)
+                if self._signature() == sig:
+                    self._snapshot = loaded
+                    return loaded
+            if snap is not None:
+                return snap
+            raise RuntimeError("Index files kept changing while loading; giving up")
+
+    def refresh(self) -> IndexSnapshot:
+        with self._lock:
+            self._snapshot = None
+        return self.snapshot()
+
+_managers: Dict[Tuple[str, ...], IndexManager] = {}
+_managers_lock = threading.Lock()
+
+def get_index_manager() -> IndexManager:
+    cfg = load_app_config()
+    key = (cfg.faiss_path, cfg.docstore_path, cfg.bm25_path, cfg.generation_path)
+    mgr = _managers.get(key)
+    if mgr is None:
+        with _managers_lock:
+            mgr = _managers.get(key)
+            if mgr is None:
+                mgr = IndexManager(*key)
+                _managers[key] = mgr
+    return mgr
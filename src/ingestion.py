@@ -1,17 +1,33 @@
-from typing import List, Tuple, Dict, Any
-import io, csv, re
-from pypdf import PdfReader
+from typing import List, Tuple, Dict, Any, Iterable, Iterator, Optional, Union
+from collections import deque
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import hashlib, io, csv, os, re
+from src.config import load_app_config
 
-def _read_pdf(name: str, data: bytes) -> str:
+# Bump when parsing or chunking changes what a file turns into, so files
+# recorded in the manifest under the old rules are parsed again
+PARSER_VERSION = 2
+
+def parser_signature() -> str:
+    cfg = load_app_config()
+    return f"v{PARSER_VERSION}:{cfg.chunk_strategy}:tokens={cfg.chunk_tokens}:overlap={cfg.chunk_overlap_tokens}"
+
+def _read_pdf(name: str, data: bytes) -> Tuple[str, List[int]]:
+    # Returns the text and the offset each page starts at
+    from pypdf import PdfReader
     with io.BytesIO(data) as f:
         reader = PdfReader(f)
-        texts = []
+        texts, starts, pos = [], [], 0
         for i, page in enumerate(reader.pages):
             try:
-                texts.append(page.extract_text() or "")
+                t = page.extract_text() or ""
             except Exception:
-                texts.append("")
-        return "\n".join(texts)
+                t = ""
+            texts.append(t)
+            starts.append(pos)
+            pos += len(t) + 1
+        return "\n".join(texts), starts
 
 def _read_text_like(name: str, data: bytes) -> str:
     return data.decode('utf-8', errors='ignore')
@@ -34,50 +50,175 @@ def _read_csv(name: str, data: bytes) -> str:
     f.seek(0)
     return f.read()
 
-def _chunk(text: str, target=1200, overlap=120) -> List[str]:
-    # Special handling for Q&A format - CREATE INDIVIDUAL Q&A PAIRS
-    if "Q:" in text and "A:" in text:
-        # Split on Q&A pairs, each pair becomes its own chunk
-        qa_pairs = re.split(r'\n\n(?=Q:)', text)
-        chunks = []
-        
-        for pair in qa_pairs:
-            pair = pair.strip()
-            if pair and len(pair) > 10:  # Skip very short/empty pairs
-                chunks.append(pair)
-        
-        return chunks if chunks else [text]
-    
-    # Fallback to regular chunking for non-Q&A content
-    text = re.sub(r'\s+',' ', text).strip()
-    chunks = []
-    i = 0
-    while i < len(text):
-        j = min(len(text), i + target)
-        chunk = text[i:j]
-        chunks.append(chunk)
-        i = max(j - overlap, j)
-    return chunks
+# Chunking works on (start, end) spans of the parsed text, found with
+# finditer in one pass; only the final chunk texts are copied out.
+Span = Tuple[int, int]
+
+_QA_BREAK = re.compile(r'\n\n(?=Q:)')
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+_WORD = re.compile(r'\S+')
+_SPACE = re.compile(r'\s+')
+
+def _tokens(start: int, end: int) -> int:
+    # Same estimate as utils.approx_tokens, without slicing the text
+    return (end - start) // 4 + 1
+
+def _pieces(text: str, brk, start: int, end: int) -> Iterator[Span]:
+    # Non-blank spans of text[start:end] between matches of `brk`
+    pos = start
+    for m in brk.finditer(text, start, end):
+        if m.start() > pos:
+            yield pos, m.start()
+        pos = m.end()
+    if pos < end:
+        yield pos, end
+
+def _words(text: str, start: int, end: int) -> Iterator[Span]:
+    for m in _WORD.finditer(text, start, end):
+        yield m.span()
+
+def _sentences(text: str, start: int, end: int, budget: int) -> Iterator[Span]:
+    # A sentence longer than the budget is cut between words
+    for s, e in _pieces(text, _SENTENCE_BREAK, start, end):
+        if _tokens(s, e) <= budget:
+            yield s, e
+        else:
+            yield from _pack(_words(text, s, e), budget, 0)
+
+def _pack(units: Iterable[Span], budget: int, overlap: int) -> Iterator[Span]:
+    # Packs consecutive units into windows of up to `budget` tokens. Each new
+    # window starts with the trailing units of the previous one, up to
+    # `overlap` tokens, as long as the next unit still fits.
+    window: List[Span] = []
+    for u in units:
+        if window and _tokens(window[0][0], u[1]) > budget:
+            yield window[0][0], window[-1][1]
+            end = window[-1][1]
+            keep = [w for w in window if _tokens(w[0], end) <= overlap]
+            window = [w for w in keep if _tokens(w[0], u[1]) <= budget]
+        window.append(u)
+    if window:
+        yield window[0][0], window[-1][1]
+
+def _chunk_qa(text: str, budget: int, overlap: int) -> Iterator[Span]:
+    # Each Q&A pair is its own chunk; an oversized answer is split by sentence
+    for s, e in _pieces(text, _QA_BREAK, 0, len(text)):
+        if e - s <= 10:  # Skip very short/empty pairs
+            continue
+        if _tokens(s, e) <= budget:
+            yield s, e
+        else:
+            yield from _pack(_sentences(text, s, e, budget), budget, overlap)
+
+def _chunk_sentence(text: str, budget: int, overlap: int) -> Iterator[Span]:
+    return _pack(_sentences(text, 0, len(text), budget), budget, overlap)
+
+def _chunk_fixed(text: str, budget: int, overlap: int) -> Iterator[Span]:
+    return _pack(_words(text, 0, len(text)), budget, overlap)
+
+CHUNKERS = {"qa": _chunk_qa, "sentence": _chunk_sentence, "fixed": _chunk_fixed}
+
+def chunk_text(text: str, strategy: str = "auto", max_tokens: int = 300,
+               overlap_tokens: int = 30) -> List[Tuple[int, int, str]]:
+    # Returns (start, end, chunk text) with offsets into `text`
+    if strategy == "auto":
+        strategy = "qa" if "Q:" in text and "A:" in text else "sentence"
+    if strategy not in CHUNKERS:
+        raise ValueError(f"Unknown chunk strategy: {strategy} (expected auto, {', '.join(CHUNKERS)})")
+    if overlap_tokens >= max_tokens:
+        raise ValueError("CHUNK_OVERLAP_TOKENS must be smaller than CHUNK_TOKENS")
+    out = []
+    for s, e in CHUNKERS[strategy](text, max_tokens, overlap_tokens):
+        # Trim to the first and last word so offsets point at real text
+        first = _WORD.search(text, s, e)
+        if first is None:
+            continue
+        s = first.start()
+        e = len(text[s:e].rstrip()) + s
+        chunk = text[s:e] if strategy == "qa" else _SPACE.sub(' ', text[s:e])
+        out.append((s, e, chunk))
+    return out
+
+def parse_file(name: str, data: bytes) -> List[Dict[str, Any]]:
+    cfg = load_app_config()
+    ext = name.lower().split('.')[-1]
+    page_starts = None
+    if ext == 'pdf':
+        content, page_starts = _read_pdf(name, data)
+    elif ext in ('txt','md'):
+        content = _read_text_like(name, data)
+    elif ext == 'csv':
+        content = _read_csv(name, data)
+    else:
+        content = _read_text_like(name, data)
+    out = []
+    chunks = chunk_text(content, cfg.chunk_strategy, cfg.chunk_tokens, cfg.chunk_overlap_tokens)
+    for idx, (start, end, ch) in enumerate(chunks):
+        out.append({
+            "text": ch,
+            "meta": {
+                "file_name": name,
+                "chunk_id": idx,
+                "page": bisect_right(page_starts, start) if page_starts else None,
+                "start": start,
+                "end": end,
+            }
+        })
+    return out
 
 def parse_files_and_chunk(files: List[Tuple[str, bytes]]):
     out = []
     for name, data in files:
-        ext = name.lower().split('.')[-1]
-        if ext == 'pdf':
-            content = _read_pdf(name, data)
-        elif ext in ('txt','md'):
-            content = _read_text_like(name, data)
-        elif ext == 'csv':
-            content = _read_csv(name, data)
-        else:
-            content = _read_text_like(name, data)
-        for idx, ch in enumerate(_chunk(content)):
-            out.append({
-                "text": ch,
-                "meta": {
-                    "file_name": name,
-                    "chunk_id": idx,
-                    "page": None
-                }
-            })
+        out.extend(parse_file(name, data))
     return out
+
+# An upload is (name, bytes); a path, or a (name, path) pair for a file
+# stored under another name (its place in a directory tree), is read inside
+# the worker so the parent never holds file contents for bulk loads.
+FileItem = Union[Tuple[str, bytes], Tuple[str, str], str]
+
+def item_name(item: FileItem) -> str:
+    return os.path.basename(item) if isinstance(item, str) else item[0]
+
+def _item_path(item: FileItem) -> Optional[str]:
+    if isinstance(item, str):
+        return item
+    return item[1] if isinstance(item[1], str) else None
+
+def fingerprint(item: FileItem) -> Dict[str, Any]:
+    # What the manifest records per file; paths are hashed in 1 MiB reads
+    h = hashlib.sha1()
+    path = _item_path(item)
+    if path is not None:
+        size = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+                size += len(block)
+    else:
+        h.update(item[1])
+        size = len(item[1])
+    return {"sha1": h.hexdigest(), "size": size, "parser": parser_signature()}
+
+def _parse_item(item: FileItem) -> Tuple[str, List[Dict[str, Any]]]:
+    path = _item_path(item)
+    if path is not None:
+        with open(path, 'rb') as f:
+            return item_name(item), parse_file(item_name(item), f.read())
+    return item[0], parse_file(item[0], item[1])
+
+def iter_parsed(items: Iterable[FileItem], workers: int = 1) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    # Yields (file_name, chunks) in input order. At most 2 * workers files are
+    # in flight, so a slow consumer (embedding) holds back parsing.
+    if workers <= 1:
+        for item in items:
+            yield _parse_item(item)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window = deque()
+        for item in items:
+            window.append(pool.submit(_parse_item, item))
+            if len(window) >= 2 * workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
@@ -0,0 +1,42 @@
+from typing import Dict, Tuple
+import asyncio, threading
+from src.config import load_app_config
+
+# Chat clients shared by reranking and generation: one per provider per
+# process (per event loop for async clients), so every call reuses the same
+# keep-alive connection pool.
+
+DEFAULT_CHAT_MODELS = {"openai": "gpt-4o-mini", "groq": "llama-3.1-8b-instant"}
+
+_clients: Dict[Tuple, object] = {}
+_clients_lock = threading.Lock()
+
+def get_client(provider: str, asynchronous: bool = False, max_retries: int = 2):
+    cfg = load_app_config()
+    loop = asyncio.get_running_loop() if asynchronous else None
+    api_key = cfg.openai_api_key if provider == "openai" else cfg.groq_api_key
+    key = (provider, api_key, max_retries, asynchronous, id(loop))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            if provider == "openai":
+                from openai import OpenAI, AsyncOpenAI
+                cls = AsyncOpenAI if asynchronous else OpenAI
+                client = cls(api_key=api_key, base_url=cfg.openai_base_url, max_retries=max_retries)
+            elif provider == "groq":
+                from groq import Groq, AsyncGroq
+                cls = AsyncGroq if asynchronous else Groq
+                client = cls(api_key=api_key, max_retries=max_retries)
+            else:
+                raise ValueError(f"Unsupported API provider: {provider}")
+            _clients[key] = client
+    return client
+
+async def aclose_clients():
+    # Async clients die with their loop; close the ones bound to this loop
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        mine = [k for k in _clients if k[3] and k[4] == id(loop)]
+        clients = [_clients.pop(k) for k in mine]
+    for client in clients:
+        await client.close()
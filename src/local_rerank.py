@@ -0,0 +1,121 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading, time
+from src.config import load_app_config
+from src.utils import hash_text, normalize_question
+
+# Cross-encoder reranking on CPU (e.g. BAAI/bge-reranker-base). Pairs are
+# grouped into length-bucketed batches scored on a thread pool (torch drops
+# the GIL inside the model); scores are cached per (question, chunk uid).
+
+_models = {}
+_models_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+
+def _load_model(cfg, model_name: str):
+    with _models_lock:
+        model = _models.get(model_name)
+        if model is None:
+            try:
+                import torch
+                from sentence_transformers import CrossEncoder
+            except ImportError:
+                raise ValueError("Local reranking requires sentence-transformers (pip install sentence-transformers)")
+            # Parallelism comes from the batch pool, one intra-op thread each
+            torch.set_num_threads(1)
+            model = CrossEncoder(model_name, max_length=cfg.rerank_max_length, device="cpu")
+            _models[model_name] = model
+    return model
+
+def _get_pool(cfg) -> ThreadPoolExecutor:
+    global _pool
+    with _models_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, cfg.rerank_threads), thread_name_prefix="rerank")
+    return _pool
+
+class PairScoreCache:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._lock:
+            score = self._scores.get(key)
+            if score is None:
+                self.misses += 1
+                return None
+            self._scores.move_to_end(key)
+            self.hits += 1
+            return score
+
+    def put_many(self, items: Dict[Tuple[str, str], float]):
+        with self._lock:
+            for key, score in items.items():
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.capacity:
+                self._scores.popitem(last=False)
+
+_cache: Optional[PairScoreCache] = None
+
+def get_pair_cache() -> Optional[PairScoreCache]:
+    global _cache
+    cfg = load_app_config()
+    if cfg.rerank_cache_size <= 0:
+        return None
+    with _models_lock:
+        if _cache is None or _cache.capacity != cfg.rerank_cache_size:
+            _cache = PairScoreCache(cfg.rerank_cache_size)
+    return _cache
+
+def _batches(passages: List[str], pending: List[int], batch_size: int) -> List[List[int]]:
+    # Similar lengths share a batch so little compute goes into padding; the
+    # batches holding the best retrieval ranks are submitted first, so a
+    # budget cut-off drops the least promising candidates
+    by_len = sorted(pending, key=lambda i: len(passages[i]))
+    batches = [by_len[s:s + batch_size] for s in range(0, len(by_len), batch_size)]
+    return sorted(batches, key=min)
+
+def score_pairs(question: str, passages: List[str], uids: List[str],
+                budget_ms: Optional[float] = None) -> List[Optional[float]]:
+    # Returns one score per passage, None for pairs not scored within budget
+    cfg = load_app_config()
+    model = _load_model(cfg, cfg.rerank_model)
+    cache = get_pair_cache()
+    qkey = hash_text(normalize_question(question))
+    scores: List[Optional[float]] = [None] * len(passages)
+    pending = []
+    for i, uid in enumerate(uids):
+        cached = cache.get((qkey, uid)) if cache is not None else None
+        if cached is None:
+            pending.append(i)
+        else:
+            scores[i] = cached
+    if not pending:
+        return scores
+
+    def run(idx: List[int]):
+        pairs = [(question, passages[i]) for i in idx]
+        return idx, model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+
+    budget_ms = cfg.rerank_budget_ms if budget_ms is None else budget_ms
+    deadline = time.perf_counter() + budget_ms / 1000 if budget_ms > 0 else None
+    pool = _get_pool(cfg)
+    futures = [pool.submit(run, b) for b in _batches(passages, pending, cfg.rerank_batch_size)]
+    done, not_done = wait(futures, timeout=None if deadline is None else max(0.0, deadline - time.perf_counter()))
+    for fut in not_done:
+        fut.cancel()
+    fresh = {}
+    for fut in done:
+        idx, batch_scores = fut.result()
+        for i, s in zip(idx, batch_scores):
+            scores[i] = float(s)
+            fresh[(qkey, uids[i])] = float(s)
+    if cache is not None and fresh:
+        cache.put_many(fresh)
+    return scores
@@ -0,0 +1,106 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+import argparse, json, os, sys
+from collections import Counter
+from src.config import load_app_config
+from src.ingestion import FileItem, fingerprint, item_name, iter_parsed
+from src.store import build_or_update_indices, file_manifest
+
+# Streaming ingestion: files are parsed in a process pool while the main
+# thread embeds and appends earlier files in micro-batches of whole files
+# (a file's chunks always land in one batch, so replacing a re-uploaded file
+# stays atomic). Each committed batch records its files' fingerprints in the
+# docstore manifest; files whose content, size and parser settings match
+# the manifest are skipped before parsing, so re-running a load after a
+# crash, or a nightly re-upload of the same corpus, only touches what changed.
+
+Progress = Callable[[str, int, int], None]  # (stage, done, total)
+
+def _unchanged(fp: Dict[str, Any], entry: Optional[Dict[str, Any]]) -> bool:
+    return entry is not None and all(entry.get(k) == v for k, v in fp.items())
+
+def ingest(items: Sequence[FileItem], on_progress: Optional[Progress] = None,
+           batch_chunks: Optional[int] = None, workers: Optional[int] = None,
+           force: bool = False) -> Dict[str, Any]:
+    cfg = load_app_config()
+    batch_chunks = batch_chunks or cfg.ingest_batch_chunks
+    workers = cfg.ingest_workers if workers is None else workers
+    report = on_progress or (lambda stage, done, total: None)
+
+    # Files are keyed by name in the manifest and the docstore, so two
+    # different files under one name would replace each other
+    counts = Counter(item_name(it) for it in items)
+    clashes = sorted(name for name, n in counts.items() if n > 1)
+    if clashes:
+        raise ValueError(f"Several files would be stored as {', '.join(clashes)}; "
+                         "give them distinct names or load them from a common directory")
+
+    manifest = file_manifest()
+    prints = {item_name(it): fingerprint(it) for it in items}
+    todo = [it for it in items if force or not _unchanged(prints[item_name(it)], manifest.get(item_name(it)))]
+    total_files = len(items)
+    skipped = total_files - len(todo)
+    stats = {"files": total_files, "skipped": skipped, "chunks": 0, "batches": 0}
+    report("parse", skipped, total_files)
+    report("index", skipped, total_files)
+
+    batch: List[Dict[str, Any]] = []
+    batch_files: List[str] = []
+    parsed = indexed = skipped
+
+    def flush():
+        nonlocal indexed
+        if not batch_files:
+            return
+        report("embed", stats["chunks"], stats["chunks"] + len(batch))
+        build_or_update_indices(batch, fingerprints={name: prints[name] for name in batch_files})
+        stats["chunks"] += len(batch)
+        stats["batches"] += 1
+        indexed += len(batch_files)
+        report("embed", stats["chunks"], stats["chunks"])
+        report("index", indexed, total_files)
+        batch.clear()
+        batch_files.clear()
+
+    # Parsing runs ahead of indexing only as far as the parse window allows
+    for name, chunks in iter_parsed(todo, workers if len(todo) > 1 else 1):
+        parsed += 1
+        report("parse", parsed, total_files)
+        batch.extend(chunks)
+        batch_files.append(name)
+        if len(batch) >= batch_chunks:
+            flush()
+    flush()
+    return stats
+
+def _expand(paths: Iterable[str]) -> List[FileItem]:
+    # Files found in a directory are named by their path below it
+    # (en/faq.md, fr/faq.md), so same-named files in subfolders stay apart
+    out: List[FileItem] = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                for n in sorted(names):
+                    full = os.path.join(root, n)
+                    out.append((os.path.relpath(full, p).replace(os.sep, "/"), full))
+        else:
+            out.append(p)
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="Bulk-load files or directories into the index")
+    ap.add_argument("paths", nargs="+")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--batch-chunks", type=int, default=None)
+    ap.add_argument("--force", action="store_true", help="re-parse files even if the manifest says they are unchanged")
+    args = ap.parse_args()
+
+    def show(stage: str, done: int, total: int):
+        print(f"\r{stage:>5}: {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    stats = ingest(_expand(args.paths), on_progress=show, batch_chunks=args.batch_chunks,
+                   workers=args.workers, force=args.force)
+    print(file=sys.stderr)
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
-from typing import List
-from openai import OpenAI
-from groq import Groq
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait
+import asyncio, logging, threading
+import numpy as np
 from src.config import load_app_config
-from src.store import DocChunk
+from src.llm import get_client
+from src.store import Candidates
+from src.local_rerank import score_pairs
+from src.telemetry import inc, span
+from src.utils import hash_text, approx_tokens
 
-def _score_with_api(question: str, passages: List[str], model: str, api_provider: str, api_key: str) -> List[float]:
-    prompt = f"""Rate the relevance of each passage to the question on a scale of 0.0 to 1.0.
+logger = logging.getLogger(__name__)
+
+def _prompt(question: str, passages: List[str]) -> str:
+    return f"""Rate the relevance of each passage to the question on a scale of 0.0 to 1.0.
 Question: {question}
 
 Passages:
@@ -13,65 +20,169 @@ Passages:
 
 Return only a comma-separated list of scores (e.g., 0.8,0.3,0.9):"""
 
-    try:
-        if api_provider == "openai":
-            import requests
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": model,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0
-            }
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            response.raise_for_status()
-            result = response.json()
-            scores_text = result["choices"][0]["message"]["content"].strip()
-            
-        elif api_provider == "groq":
-            client = Groq(api_key=api_key)
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
-            )
-            scores_text = response.choices[0].message.content.strip()
-        
-        else:
-            raise ValueError(f"Unsupported API provider: {api_provider}")
-        
-        scores = [float(s.strip()) for s in scores_text.split(',')]
-        if len(scores) != len(passages):
-            scores = [0.5] * len(passages)
-            
-    except Exception as e:
-        print(f"Reranking error: {e}")
-        scores = [0.5] * len(passages)
-    
+def _parse_scores(scores_text: str, n: int) -> List[float]:
+    scores = [float(s.strip()) for s in scores_text.split(',')]
+    if len(scores) != n:
+        raise ValueError(f"Expected {n} scores, got {len(scores)}")
     return scores
 
-def maybe_rerank(question: str, candidates: List[DocChunk], topk_after: int, use_rerank: bool):
-    if not use_rerank or not candidates:
-        return candidates[:topk_after]
-    
+# API reranking: candidates are split into token-budgeted groups, each
+# scored by its own small chat call, all in flight at once over one pooled
+# client. A failed or late group leaves its passages unscored (None), and
+# unscored passages keep their retrieval order behind the scored ones.
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool(cfg) -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, cfg.rerank_concurrency), thread_name_prefix="rerank-api")
+    return _pool
+
+def _groups(passages: List[str], cfg) -> List[List[int]]:
+    # Each passage is capped at rerank_passage_tokens; groups stay under
+    # rerank_group_tokens and rerank_group_size
+    groups, cur, cur_tokens = [], [], 0
+    for i, p in enumerate(passages):
+        n = min(approx_tokens(p), cfg.rerank_passage_tokens)
+        if cur and (cur_tokens + n > cfg.rerank_group_tokens or len(cur) >= cfg.rerank_group_size):
+            groups.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(i)
+        cur_tokens += n
+    if cur:
+        groups.append(cur)
+    return groups
+
+def _group_prompt(question: str, passages: List[str], idx: List[int], cfg) -> str:
+    limit = cfg.rerank_passage_tokens * 4
+    return _prompt(question, [passages[i][:limit] for i in idx])
+
+def _deadline_s(cfg) -> float:
+    return (cfg.rerank_budget_ms or 30000) / 1000
+
+def _score_group(cfg, question: str, passages: List[str], idx: List[int], timeout: float) -> List[float]:
+    response = get_client(cfg.api_provider, max_retries=0).chat.completions.create(
+        model=cfg.rerank_model,
+        messages=[{"role": "user", "content": _group_prompt(question, passages, idx, cfg)}],
+        temperature=0,
+        timeout=timeout,
+    )
+    return _parse_scores(response.choices[0].message.content.strip(), len(idx))
+
+async def _ascore_group(cfg, question: str, passages: List[str], idx: List[int], timeout: float) -> List[float]:
+    response = await get_client(cfg.api_provider, asynchronous=True, max_retries=0).chat.completions.create(
+        model=cfg.rerank_model,
+        messages=[{"role": "user", "content": _group_prompt(question, passages, idx, cfg)}],
+        temperature=0,
+        timeout=timeout,
+    )
+    return _parse_scores(response.choices[0].message.content.strip(), len(idx))
+
+def _report(sp, groups: int, late: int, errors: List[Exception]):
+    sp.set(groups=groups, late=late, failed=len(errors))
+    inc("rag_rerank_groups_total", groups - late - len(errors), status="ok")
+    inc("rag_rerank_groups_total", late, status="late")
+    inc("rag_rerank_groups_total", len(errors), status="error")
+    for e in errors:
+        logger.warning("Reranking error: %s", e)
+    if late or errors:
+        logger.warning("Reranking: %d/%d groups unscored", late + len(errors), groups)
+
+def _score_with_api(question: str, passages: List[str]) -> List[Optional[float]]:
     cfg = load_app_config()
-    passages = [c.text for c in candidates]
+    with span("rerank.api", model=cfg.rerank_model, passages=len(passages)) as sp:
+        timeout = _deadline_s(cfg)
+        scores: List[Optional[float]] = [None] * len(passages)
+        groups = _groups(passages, cfg)
+        pool = _get_pool(cfg)
+        futures = {pool.submit(_score_group, cfg, question, passages, idx, timeout): idx for idx in groups}
+        done, not_done = wait(futures, timeout=timeout)
+        for fut in not_done:
+            fut.cancel()
+        errors = []
+        for fut in done:
+            try:
+                group_scores = fut.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            for i, sc in zip(futures[fut], group_scores):
+                scores[i] = sc
+        _report(sp, len(groups), len(not_done), errors)
+        return scores
+
+async def _ascore_with_api(question: str, passages: List[str]) -> List[Optional[float]]:
+    cfg = load_app_config()
+    with span("rerank.api", model=cfg.rerank_model, passages=len(passages)) as sp:
+        timeout = _deadline_s(cfg)
+        scores: List[Optional[float]] = [None] * len(passages)
+        groups = _groups(passages, cfg)
+        tasks = {asyncio.ensure_future(_ascore_group(cfg, question, passages, idx, timeout)): idx for idx in groups}
+        done, not_done = await asyncio.wait(tasks, timeout=timeout)
+        for task in not_done:
+            task.cancel()
+        errors = []
+        for task in done:
+            if task.exception() is not None:
+                errors.append(task.exception())
+                continue
+            for i, sc in zip(tasks[task], task.result()):
+                scores[i] = sc
+        _report(sp, len(groups), len(not_done), errors)
+        return scores
+
+def maybe_rerank(question: str, candidates: Candidates, topk_after: int, use_rerank: bool) -> Candidates:
+    if not use_rerank or not len(candidates):
+        return candidates.head(topk_after)
     
-    if cfg.api_provider == "openai":
-        scores = _score_with_api(question, passages, cfg.rerank_model, "openai", cfg.openai_api_key)
-    elif cfg.api_provider == "groq":
-        scores = _score_with_api(question, passages, cfg.rerank_model, "groq", cfg.groq_api_key)
+    cfg = load_app_config()
+    records = candidates.records()
+    passages = [d["text"] for d in records]
+    if cfg.rerank_provider == "local":
+        with span("rerank.local", model=cfg.rerank_model, passages=len(passages)) as sp:
+            scores = _score_locally(question, passages, _uids(records))
+            sp.set(unscored=scores.count(None))
     else:
-        raise ValueError(f"Unsupported API provider: {cfg.api_provider}")
-    
-    for c, s in zip(candidates, scores):
-        c.score = float(s)
-    
-    return sorted(candidates, key=lambda x: x.score, reverse=True)[:topk_after]
+        scores = _score_with_api(question, passages)
+    return _apply_scores(candidates, scores, topk_after)
+
+async def amaybe_rerank(question: str, candidates: Candidates, topk_after: int, use_rerank: bool) -> Candidates:
+    if not use_rerank or not len(candidates):
+        return candidates.head(topk_after)
+
+    cfg = load_app_config()
+    records = candidates.records()
+    passages = [d["text"] for d in records]
+    if cfg.rerank_provider == "local":
+        # CPU-bound: keep it off the event loop
+        with span("rerank.local", model=cfg.rerank_model, passages=len(passages)) as sp:
+            scores = await asyncio.to_thread(_score_locally, question, passages, _uids(records))
+            sp.set(unscored=scores.count(None))
+    else:
+        scores = await _ascore_with_api(question, passages)
+    return _apply_scores(candidates, scores, topk_after)
+
+def _score_locally(question: str, passages: List[str], uids: List[str]) -> List[Optional[float]]:
+    # A cross-encoder that can't load (sentence-transformers missing, model
+    # not downloadable) leaves every passage unscored, i.e. in retrieval order
+    try:
+        return score_pairs(question, passages, uids)
+    except Exception as e:
+        logger.warning("Local reranking unavailable: %s", e)
+        inc("rag_rerank_fallback_total", reason="local_unavailable")
+        return [None] * len(passages)
+
+def _uids(records) -> List[str]:
+    return [d.get("uid") or hash_text(d["text"]) for d in records]
+
+def _apply_scores(candidates: Candidates, scores: List[Optional[float]], topk_after: int) -> Candidates:
+    # Scored candidates first by score; any left unscored (failed group or
+    # time budget ran out) follow in retrieval order with their fused score
+    scored = np.array([s is not None for s in scores], dtype=bool)
+    new = np.array([c if s is None else s for c, s in zip(candidates.scores.tolist(), scores)], dtype=np.float32)
+    hit = np.flatnonzero(scored)
+    order = np.concatenate([hit[np.argsort(-new[hit], kind="stable")], np.flatnonzero(~scored)])[:topk_after]
+    return Candidates(candidates.ids[order], new[order], candidates.docs)
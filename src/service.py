@@ -0,0 +1,129 @@
+from typing import Any, AsyncIterator, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, time
+from src.config import load_app_config
+from src.graph import get_graph, initial_state
+from src.index_manager import get_index_manager
+from src.embed_engine import aclose_embedding_engines
+from src.llm import aclose_clients
+from src.answer_cache import alookup_answer, get_answer_cache
+from src.telemetry import inc, set_attrs, trace
+from src.utils import normalize_question
+
+def _graph_config(use_hybrid: bool, use_rerank: bool, topk_vec: int, topk_bm25: int, topk_after: int) -> Dict:
+    return {
+        "topk_vec": topk_vec,
+        "topk_bm25": topk_bm25,
+        "topk_after": topk_after,
+        "use_hybrid": use_hybrid,
+        "use_rerank": use_rerank,
+    }
+
+class QueryService:
+    # One per process: compiled graphs and the index snapshot stay warm, and
+    # identical questions already in flight share a single pipeline run
+    def __init__(self, workers: int = 64):
+        self.workers = workers
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # Sync graph nodes (FAISS, BM25, merge) run in the default executor
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rag"))
+        for use_hybrid in (False, True):
+            for use_rerank in (False, True):
+                get_graph(use_hybrid, use_rerank)
+        await loop.run_in_executor(None, get_index_manager().snapshot)
+
+    async def close(self):
+        await aclose_embedding_engines()
+        await aclose_clients()
+
+    async def answer(self, question: str, use_hybrid: bool = True, use_rerank: bool = True,
+                     topk_vec: int = 5, topk_bm25: int = 5, topk_after: int = 5) -> Dict[str, Any]:
+        question = question.strip()
+        if not question:
+            raise ValueError("Question must not be empty")
+        config = _graph_config(use_hybrid, use_rerank, topk_vec, topk_bm25, topk_after)
+        key = (normalize_question(question), use_hybrid, use_rerank, topk_vec, topk_bm25, topk_after)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(question, config))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+        else:
+            self.coalesced += 1
+        # A caller that disconnects must not cancel the run others wait on
+        return await asyncio.shield(task)
+
+    async def answer_stream(self, question: str, use_hybrid: bool = True, use_rerank: bool = True,
+                            topk_vec: int = 5, topk_bm25: int = 5, topk_after: int = 5) -> AsyncIterator[Tuple[str, Any]]:
+        # Yields ("citations", [...]) first, then ("token", str)..., then
+        # ("done", {...}). Streams are per caller, so no coalescing here.
+        question = question.strip()
+        if not question:
+            raise ValueError("Question must not be empty")
+        config = _graph_config(use_hybrid, use_rerank, topk_vec, topk_bm25, topk_after)
+        t0 = time.perf_counter()
+        with trace("ask", hybrid=use_hybrid, rerank=use_rerank, stream=True):
+            cache, generation, query_vec, hit, tier = await alookup_answer(question, config)
+            inc("rag_answers_total", cached=tier if hit is not None else "none", mode="stream")
+            if hit is not None:
+                set_attrs(cached=tier)
+                yield "citations", hit["citations"]
+                yield "token", hit["answer"]
+                yield "done", {"cached": tier, "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)}
+                return
+
+            self.executed += 1
+            graph = get_graph(use_hybrid, use_rerank)
+            state = await graph.ainvoke(initial_state(question, {**config, "stream": True}, query_vec))
+            yield "citations", state["citations"]
+            first_token_ms, parts = None, []
+            async for token in state["answer_stream"]:
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - t0) * 1000, 1)
+                parts.append(token)
+                yield "token", token
+            answer = "".join(parts).strip()
+            if cache is not None:
+                await asyncio.to_thread(cache.put, question, config, generation,
+                                        {"answer": answer, "citations": state["citations"]}, state["query_vec"])
+            yield "done", {"cached": None, "first_token_ms": first_token_ms,
+                           "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+    async def _run(self, question: str, config: Dict) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        with trace("ask", hybrid=config["use_hybrid"], rerank=config["use_rerank"]):
+            cache, generation, query_vec, hit, tier = await alookup_answer(question, config)
+            inc("rag_answers_total", cached=tier if hit is not None else "none", mode="answer")
+            set_attrs(cached=tier if hit is not None else None)
+            if hit is not None:
+                out = {"answer": hit["answer"], "citations": hit["citations"], "cached": tier}
+            else:
+                self.executed += 1
+                graph = get_graph(config["use_hybrid"], config["use_rerank"])
+                state = await graph.ainvoke(initial_state(question, config, query_vec))
+                out = {"answer": state["answer"], "citations": state["citations"], "cached": None}
+                if cache is not None:
+                    await asyncio.to_thread(cache.put, question, config, generation,
+                                            {"answer": out["answer"], "citations": out["citations"]}, state["query_vec"])
+        out["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        snap = get_index_manager().snapshot()
+        cache = get_answer_cache()
+        return {
+            "answer_cache": cache.stats() if cache is not None else None,
+            "generation": snap.generation,
+            "docs": len(snap.docs) if snap.docs is not None else 0,
+            "inflight": len(self._inflight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
+
+def create_service() -> QueryService:
+    return QueryService(load_app_config().api_workers)
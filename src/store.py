@@ -1,136 +1,396 @@
-from typing import List, Dict, Any, Tuple
-import os, json, pickle
+from typing import List, Dict, Any, Tuple, Optional
+import logging, os, threading
 import numpy as np
-import faiss
-from rank_bm25 import BM25Okapi
 from src.config import load_app_config
-from src.embeddings import embed_texts
+from src.embeddings import embed_texts, aembed_texts
 from src.utils import hash_text
+from src.index_manager import get_index_manager, generation_write
+from src.bm25 import BM25Index, tokenize
+from src.docstore import DocStore, load_legacy_json
+from src.vector_index import add_vectors, remove_vectors, rebuild_without, write_report, search_params, read_index, write_index
+from src.telemetry import inc
+
+logger = logging.getLogger(__name__)
 
 class DocChunk:
-    def __init__(self, text: str, meta: Dict[str,Any], score: float=0.0):
-        self.text=text; self.meta=meta; self.score=score
+    __slots__ = ("text", "meta", "score", "uid", "id")
 
-def _paths():
-    cfg = load_app_config()
-    return cfg.faiss_path, cfg.docstore_path, cfg.bm25_path
+    def __init__(self, text: str, meta: Dict[str,Any], score: float=0.0, uid: Optional[str]=None, id: int=-1):
+        self.text=text; self.meta=meta; self.score=score; self.uid=uid; self.id=id
+
+class Candidates:
+    # Ranked docstore ids and scores, tied to the snapshot they were read
+    # from. Retrieval, fusion and rerank pass these along without touching
+    # the docstore; text and meta are read (resolve) only for the chunks that
+    # reach the prompt. The arrays are read-only, so results can be shared.
+    __slots__ = ("ids", "scores", "docs")
+
+    def __init__(self, ids, scores, docs=None):
+        self.ids = np.array(ids, dtype=np.int64)
+        self.scores = np.array(scores, dtype=np.float32)
+        self.ids.setflags(write=False)
+        self.scores.setflags(write=False)
+        self.docs = docs
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def head(self, n: int) -> 'Candidates':
+        return Candidates(self.ids[:n], self.scores[:n], self.docs)
+
+    def records(self) -> List[Dict[str, Any]]:
+        return [self.docs[i] for i in self.ids.tolist()]
+
+    def resolve(self, n: Optional[int] = None) -> List[DocChunk]:
+        c = self if n is None else self.head(n)
+        return [DocChunk(d["text"], d["meta"], s, d.get("uid"), i)
+                for d, i, s in zip(c.records(), c.ids.tolist(), c.scores.tolist())]
+
+EMPTY = Candidates([], [])
 
 def _ensure_dirs():
-    for p in _paths():
+    cfg = load_app_config()
+    for p in (cfg.faiss_path, cfg.docstore_path):
         d = os.path.dirname(p)
         if d and not os.path.exists(d):
             os.makedirs(d, exist_ok=True)
 
-def build_or_update_indices(chunks: List[Dict[str,Any]]):
+# One writer at a time per process; readers never take this lock
+_write_lock = threading.RLock()
+_compacting = threading.Event()
+
+def _file_table(store, legacy) -> Dict[str, Dict[str, Any]]:
+    # files.json is authoritative once written, even when empty (every file
+    # deleted); only a store from before per-file tracking derives it, once
+    path = load_app_config().docstore_path
+    if DocStore.has_files(path) or not (len(store) or legacy):
+        return DocStore.read_files(path)
+    files: Dict[str, Dict[str, Any]] = {}
+    for d in [*store.live(), *legacy]:
+        entry = files.setdefault(d["meta"]["file_name"], {"version": 1, "ids": []})
+        entry["ids"].append(d["id"])
+    return files
+
+def _drop_vectors(cfg, ids: List[int], index=None):
+    # Drop ids from FAISS where cheap. Returns the (possibly modified)
+    # index to write, or None.
+    if index is not None:
+        remove_vectors(index, ids)
+        return index
+    if not os.path.exists(cfg.faiss_path):
+        return None
+    index = read_index(cfg.faiss_path)
+    return index if remove_vectors(index, ids) else None
+
+def _delete_ids(cfg, ids: List[int], index=None):
+    # Tombstone in the docstore and BM25; drop from FAISS where cheap
+    DocStore.mark_deleted(cfg.docstore_path, ids)
+    BM25Index.mark_deleted(cfg.bm25_path, ids)
+    return _drop_vectors(cfg, ids, index)
+
+def file_manifest() -> Dict[str, Dict[str, Any]]:
+    # file_name -> {"version", "ids", and for files ingested with a
+    # fingerprint "sha1", "size", "parser"}. Derived (not written) for a
+    # store from before per-file tracking.
+    path = load_app_config().docstore_path
+    store = DocStore(path)
+    return _file_table(store, [] if len(store) else load_legacy_json(path))
+
+def _chunk_uid(file_name: str, text: str, nth: int) -> str:
+    # Position-independent, so inserting a Q&A pair near the top of a file
+    # doesn't change the uid of every chunk below it; nth tells apart
+    # identical chunks within one file
+    return hash_text(f"{file_name}\x00{nth}\x00{text}")
+
+# Where a chunk sits in its file; citations read these, so a kept chunk
+# whose position changed gets them updated (its vector and postings stay)
+POSITION_KEYS = ("chunk_id", "page", "start", "end")
+
+def _moved(old: Dict[str, Any], new: Dict[str, Any]) -> bool:
+    return any(old.get(k) != new.get(k) for k in POSITION_KEYS)
+
+def build_or_update_indices(chunks: List[Dict[str,Any]], replace_files: bool = True,
+                            fingerprints: Optional[Dict[str, Dict[str, Any]]] = None):
+    # With replace_files, every file in `chunks` is treated as its complete
+    # new version: its chunks missing from the upload are deleted.
+    # fingerprints (file_name -> ingestion.fingerprint) go into the manifest
+    # so the next ingest can skip those files without parsing them.
+    with _write_lock:
+        cfg = load_app_config()
+        _ensure_dirs()
+
+        # Stores written before the binary docstore are migrated on this write
+        store = DocStore(cfg.docstore_path)
+        legacy = [] if len(store) else load_legacy_json(cfg.docstore_path)
+        # Legacy uids hashed the chunk position: re-key them the way new
+        # chunks are keyed so a re-upload replaces them instead of adding
+        # a second copy
+        legacy_ids: Dict[str, int] = {}
+        counts: Dict[Tuple[str, str], int] = {}
+        for d in legacy:
+            key = (d["meta"]["file_name"], d["text"])
+            d["uid"] = _chunk_uid(*key, counts.get(key, 0))
+            counts[key] = counts.get(key, 0) + 1
+            legacy_ids[d["uid"]] = d["id"]
+        docs = legacy or store
+        files = _file_table(store, legacy)
+
+        # docstore - APPEND new chunks, skip live duplicates (O(1) uid lookups on disk).
+        # Ids a failed write already gave to FAISS/BM25 are skipped and
+        # tombstoned (`gap`), never reused.
+        first_id = max(len(store) + len(legacy), DocStore.reserved(cfg.docstore_path))
+        gap = list(range(len(store) + len(legacy), first_id))
+        start_id = first_id
+        new_chunks = []
+        present: Dict[str, List[int]] = {}
+        moved: Dict[int, Dict[str, Any]] = {}
+        uploaded: Dict[str, set] = {}
+        occurrences: Dict[Tuple[str, str], int] = {}
+
+        for c in chunks:
+            # Create unique ID for this chunk
+            name = c["meta"]["file_name"]
+            nth = occurrences.get((name, c["text"]), 0)
+            occurrences[(name, c["text"])] = nth + 1
+            uid = _chunk_uid(name, c["text"], nth)
+            seen = uploaded.setdefault(name, set())
+
+            # Skip if already processed
+            if uid in seen:
+                continue
+            seen.add(uid)
+            existing = legacy_ids.get(uid) if legacy else store.lookup_uid(uid)
+            if existing is not None and docs.is_live(existing):
+                meta = docs[existing]["meta"]
+                if _moved(meta, c["meta"]):
+                    position = {k: c["meta"].get(k) for k in POSITION_KEYS}
+                    if legacy:
+                        meta.update(position)  # appended by this write anyway
+                    else:
+                        moved[existing] = position
+                present.setdefault(name, []).append(existing)
+                continue
+
+            c["id"] = start_id
+            c["uid"] = uid
+            new_chunks.append(c)
+            start_id += 1
+
+        # Chunks of re-uploaded files that are not in the new version
+        stale = []
+        if replace_files:
+            for name, uids in uploaded.items():
+                for i in files.get(name, {}).get("ids", []):
+                    if i < len(docs) and docs.is_live(i) and docs.uid(i) not in uids:
+                        stale.append(i)
+
+        changed = {c["meta"]["file_name"] for c in new_chunks}
+        changed.update(docs[i]["meta"]["file_name"] for i in stale)
+        stale_set = set(stale)
+        for name in changed:
+            entry = files.setdefault(name, {"version": 0, "ids": []})
+            entry["version"] += 1
+            entry["ids"] = [i for i in entry["ids"] if i not in stale_set]
+        for c in new_chunks:
+            entry = files[c["meta"]["file_name"]]
+            c["meta"]["version"] = entry["version"]
+            entry["ids"].append(c["id"])
+        # Chunks committed by a write that failed before files.json
+        recovered = False
+        for name, ids in present.items():
+            entry = files.setdefault(name, {"version": 1, "ids": []})
+            known = set(entry["ids"])
+            missing = [i for i in ids if i not in known]
+            entry["ids"].extend(missing)
+            recovered |= bool(missing)
+        for name, fp in (fingerprints or {}).items():
+            files.setdefault(name, {"version": 0, "ids": []}).update(fp)
+
+        # Same chunks as before (a re-saved file, or one already ingested
+        # under another fingerprint): record the manifest only, so readers
+        # and the answer cache keep the current generation
+        if not new_chunks and not stale and not moved and not legacy:
+            if fingerprints or recovered:
+                DocStore.write_files(cfg.docstore_path, files)
+            return
+
+        # Embed (and build the FAISS index) before touching any file so a failed
+        # API call leaves the store as-is
+        index, report = None, None
+        if new_chunks:
+            new_texts = [d["text"] for d in new_chunks]
+            new_vecs = embed_texts(cfg.embed_model, new_texts).astype('float32')
+            # Reads from disk: the snapshot's index is shared with readers
+            index, report = add_vectors(cfg.faiss_path, new_vecs, np.array([d["id"] for d in new_chunks]))
+
+        dead = gap + stale
+        if dead:
+            index = _drop_vectors(cfg, dead, index)
+        placeholders = [{"id": i, "uid": "", "text": "", "meta": {}} for i in gap]
+
+        with generation_write(cfg.generation_path):
+            # Vectors and postings go in first, under ids the docstore doesn't
+            # have yet (searches skip them); appending the docstore rows is
+            # what publishes the batch. The ids are reserved before anything
+            # is written, so a failure part way leaves only unreachable ids
+            # that the next write tombstones.
+            DocStore.reserve(cfg.docstore_path, start_id)
+            if index is not None:
+                write_index(index, cfg.faiss_path)
+                if report is not None:
+                    write_report(report)
+
+            # BM25 - one new segment holding only the new chunks; the first
+            # segment (or the migration of an older store) covers every doc
+            seg_docs = new_chunks if BM25Index.exists(cfg.bm25_path) else [*store.live(), *legacy, *new_chunks]
+            BM25Index.append_segment(cfg.bm25_path, [d["id"] for d in seg_docs], [d["text"] for d in seg_docs])
+
+            DocStore.append(cfg.docstore_path, legacy + placeholders + new_chunks)
+            DocStore.set_positions(cfg.docstore_path, moved)
+            if dead:
+                DocStore.mark_deleted(cfg.docstore_path, dead)
+                BM25Index.mark_deleted(cfg.bm25_path, dead)
+            DocStore.write_files(cfg.docstore_path, files)
+
+    # Hot-swap this process to the new snapshot right away
+    get_index_manager().snapshot()
+    maybe_compact()
+
+def delete_file(file_name: str) -> int:
+    # Remove every chunk of `file_name` from all indices; returns the count
+    with _write_lock:
+        cfg = load_app_config()
+        if not DocStore.exists(cfg.docstore_path) and load_legacy_json(cfg.docstore_path):
+            build_or_update_indices([])  # migrate first: tombstones need the binary docstore
+        store = DocStore(cfg.docstore_path)
+        files = _file_table(store, [])
+        entry = files.pop(file_name, None)
+        ids = [i for i in (entry or {}).get("ids", []) if i < len(store) and store.is_live(i)]
+        with generation_write(cfg.generation_path):
+            index = _delete_ids(cfg, ids) if ids else None
+            if index is not None:
+                write_index(index, cfg.faiss_path)
+            DocStore.write_files(cfg.docstore_path, files)
+    get_index_manager().snapshot()
+    maybe_compact()
+    return len(ids)
+
+def compact_indices():
+    # Physically drop tombstoned chunks from FAISS, BM25 and the docstore.
+    # Doc ids are never reused, so nothing needs renumbering.
+    with _write_lock:
+        cfg = load_app_config()
+        store = DocStore(cfg.docstore_path)
+        dead = store.dead_ids()
+        index, report = None, None
+        if len(dead) and os.path.exists(cfg.faiss_path):
+            index, report = rebuild_without(read_index(cfg.faiss_path), dead)
+        with generation_write(cfg.generation_path):
+            if index is not None:
+                write_index(index, cfg.faiss_path)
+                write_report(report)
+            elif len(dead) and len(dead) == len(store) and os.path.exists(cfg.faiss_path):
+                os.remove(cfg.faiss_path)
+            BM25Index.compact(cfg.bm25_path)
+            del store
+            DocStore.compact(cfg.docstore_path)
+    get_index_manager().snapshot()
+
+def maybe_compact(background: bool = True):
+    # Compact once tombstones pass COMPACT_DEAD_RATIO of the docstore
     cfg = load_app_config()
-    _ensure_dirs()
-    
-    # Load existing docs to check for duplicates
-    existing_docs = load_docstore() if os.path.exists(cfg.docstore_path) else []
-    existing_uids = {doc.get("uid") for doc in existing_docs if doc.get("uid")}
-    
-    # docstore - APPEND new chunks, skip duplicates
-    docs = existing_docs.copy()
-    start_id = len(docs)
-    new_chunks = []
-    
-    for c in chunks:
-        # Create unique ID for this chunk
-        uid = hash_text(c["text"] + c["meta"]["file_name"] + str(c["meta"]["chunk_id"]))
-        
-        # Skip if already processed
-        if uid in existing_uids:
-            continue
-            
-        c["id"] = start_id
-        c["uid"] = uid
-        docs.append(c)
-        new_chunks.append(c)
-        existing_uids.add(uid)
-        start_id += 1
-    with open(cfg.docstore_path,'w',encoding='utf-8') as f:
-        json.dump(docs,f,ensure_ascii=False)
-
-    # embeddings + FAISS - only process NEW chunks
-    if new_chunks:
-        new_texts = [d["text"] for d in new_chunks]
-        new_vecs = embed_texts(cfg.embed_model, new_texts).astype('float32')
-        
-        # Load existing FAISS index or create new one
-        if os.path.exists(cfg.faiss_path):
-            index = faiss.read_index(cfg.faiss_path)
-            index.add(new_vecs)  # Add new vectors to existing index
-        else:
-            index = faiss.IndexFlatIP(new_vecs.shape[1])
-            index.add(new_vecs)
-        faiss.write_index(index, cfg.faiss_path)
-
-    # BM25 - rebuild with all texts (BM25 needs all texts together)
-    all_texts = [d["text"] for d in docs]
-    tokenized = [t.lower().split() for t in all_texts]
-    bm25 = BM25Okapi(tokenized) if tokenized else None
-    with open(cfg.bm25_path,'wb') as f:
-        pickle.dump({"bm25": bm25, "texts": all_texts}, f)
+    store = get_index_manager().snapshot().docs
+    if not len(store) or store.dead_count() / len(store) < cfg.compact_dead_ratio:
+        return
+    if not background:
+        compact_indices()
+        return
+    if _compacting.is_set():
+        return
+    _compacting.set()
+
+    def run():
+        try:
+            compact_indices()
+        except Exception:
+            # The generation is left odd; readers load past it once this
+            # thread is gone, and the next write publishes a new one
+            logger.exception("Background compaction failed")
+            inc("rag_compaction_failures_total")
+        finally:
+            _compacting.clear()
+    threading.Thread(target=run, name="compaction", daemon=True).start()
 
 def load_docstore():
-    cfg = load_app_config()
-    if not os.path.exists(cfg.docstore_path):
-        return []
-    with open(cfg.docstore_path,'r',encoding='utf-8') as f:
-        return json.load(f)
+    return get_index_manager().snapshot().docs
 
 def load_indices():
+    snap = get_index_manager().snapshot()
+    return snap.faiss, snap.bm25, snap.docs
+
+def embed_query(query: str) -> np.ndarray:
     cfg = load_app_config()
-    # FAISS
-    faiss_idx = None
-    if os.path.exists(cfg.faiss_path):
-        faiss_idx = faiss.read_index(cfg.faiss_path)
-    # BM25
-    bm25 = None
-    if os.path.exists(cfg.bm25_path):
-        import pickle
-        with open(cfg.bm25_path,'rb') as f:
-            obj = pickle.load(f)
-            bm25 = obj.get("bm25")
-    return faiss_idx, bm25, load_docstore()
-
-def faiss_search(query: str, topk: int) -> List[DocChunk]:
+    return _query_matrix(embed_texts(cfg.embed_model, [query]))
+
+def embed_queries(queries: List[str]) -> np.ndarray:
+    # One embed call for the whole batch (the engine splits it into requests)
     cfg = load_app_config()
-    idx, _, docs = load_indices()
-    if idx is None or not docs:
-        return []
-    import numpy as np
-    qv = embed_texts(cfg.embed_model, [query]).astype('float32')
-    
+    return embed_texts(cfg.embed_model, queries).astype('float32')
+
+async def aembed_query(query: str) -> np.ndarray:
+    cfg = load_app_config()
+    return _query_matrix(await aembed_texts(cfg.embed_model, [query]))
+
+def _query_matrix(qv) -> np.ndarray:
+    qv = qv.astype('float32')
     # Ensure qv is 2D (n_samples, n_features) as expected by FAISS
     if qv.ndim == 1:
         qv = qv.reshape(1, -1)
     elif qv.ndim == 3:
         qv = qv.reshape(qv.shape[0], -1)
-    
-    sims, I = idx.search(qv, topk)
-    out = []
-    
-    for rank, (score, i) in enumerate(zip(sims[0], I[0])):
-        if i < 0 or i >= len(docs): 
-            continue
-        d = docs[i]
-        out.append(DocChunk(d["text"], d["meta"], float(score)))
-    return out
-
-def bm25_search(query: str, topk: int) -> List[DocChunk]:
-    cfg = load_app_config()
+    return qv
+
+def faiss_search(query: str, topk: int, query_vec: Optional[np.ndarray] = None,
+                 nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Candidates:
+    idx, _, docs = load_indices()
+    if idx is None or not docs:
+        return EMPTY
+    qv = embed_query(query) if query_vec is None else query_vec
+    return faiss_search_batch(qv, topk, nprobe, ef_search)[0]
+
+def faiss_search_batch(query_vecs: np.ndarray, topk: int, nprobe: Optional[int] = None,
+                       ef_search: Optional[int] = None) -> List[Candidates]:
+    # One matrix search for all queries; rows of query_vecs are queries
+    idx, _, docs = load_indices()
+    if idx is None or not docs or not len(query_vecs):
+        return [EMPTY for _ in range(len(query_vecs))]
+    qv = np.ascontiguousarray(query_vecs, dtype=np.float32)
+
+    # Over-fetch when tombstones may still sit in the index (non-flat types)
+    dead = docs.dead_count()
+    fetch = topk + min(dead, 3 * topk)
+    sims, I = idx.search(qv, fetch, params=search_params(idx, nprobe, ef_search))
+    results = []
+    for row_sims, row_ids in zip(sims, I):
+        hits = np.flatnonzero((row_ids >= 0) & (row_ids < len(docs)))
+        if dead:
+            hits = hits[np.fromiter((docs.is_live(int(i)) for i in row_ids[hits]), dtype=bool, count=len(hits))]
+        hits = hits[:topk]
+        results.append(Candidates(row_ids[hits], row_sims[hits], docs))
+    return results
+
+def bm25_search(query: str, topk: int, tokens: Optional[List[str]] = None) -> Candidates:
+    _, bm25, docs = load_indices()
+    if bm25 is None or not docs:
+        return EMPTY
+    tokenized_query = tokenize(query) if tokens is None else tokens
+    ids, scores = bm25.top_k(tokenized_query, topk)
+    keep = ids < len(docs)
+    return Candidates(ids[keep], scores[keep], docs)
+
+def bm25_search_batch(token_lists: List[List[str]], topk: int) -> List[Candidates]:
     _, bm25, docs = load_indices()
     if bm25 is None or not docs:
-        return []
-    texts = [d["text"] for d in docs]
-    tokenized_query = query.lower().split()
-    scores = bm25.get_scores(tokenized_query)
-    order = np.argsort(scores)[::-1][:topk]
-    out = []
-    
-    for rank, i in enumerate(order):
-        d = docs[int(i)]
-        score = scores[int(i)]
-        out.append(DocChunk(d["text"], d["meta"], float(score)))
-    return out
+        return [EMPTY for _ in token_lists]
+    return [Candidates(ids[ids < len(docs)], scores[ids < len(docs)], docs)
+            for ids, scores in bm25.top_k_batch(token_lists, topk)]
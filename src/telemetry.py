@@ -0,0 +1,207 @@
+from typing import Any, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools, inspect, json, os, threading, time, uuid
+from src.config import load_app_config
+
+# Tracing and metrics without extra dependencies:
+#   trace(name)          collects every span of one request (e.g. a question)
+#   span(name, **attrs)  times a block; nested spans record their parent
+#   inc / observe        Prometheus-style counters and histograms, served as
+#                        text by render_metrics() (GET /metrics on the API)
+# Every span also feeds the rag_span_seconds histogram. With TRACE_LOG_PATH
+# set, finished traces are appended as JSON lines using the OpenTelemetry
+# span fields (traceId, spanId, parentSpanId, start/end in unix nanos).
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attrs", "error")
+
+    def __init__(self, name: str, trace_id: Optional[str], parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def otel(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attrs,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def waterfall(self) -> List[Dict[str, Any]]:
+        # One row per span in start order: offset from the trace start,
+        # duration and nesting depth
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        if not spans:
+            return []
+        t0 = spans[0].start_ns
+        by_id = {s.span_id: s for s in spans}
+        rows = []
+        for s in spans:
+            depth, p = 0, by_id.get(s.parent_id)
+            while p is not None:
+                depth += 1
+                p = by_id.get(p.parent_id)
+            rows.append({"span": s.name, "depth": depth, "start_ms": round((s.start_ns - t0) / 1e6, 2),
+                         "duration_ms": round(s.duration_ms, 2), "error": s.error, **s.attrs})
+        return rows
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("rag_trace", default=None)
+_span: ContextVar[Optional[Span]] = ContextVar("rag_span", default=None)
+
+@contextmanager
+def span(name: str, **attrs):
+    tr = _trace.get()
+    parent = _span.get()
+    s = Span(name, tr.trace_id if tr else None, parent.span_id if parent else None, attrs)
+    _span.set(s)
+    try:
+        yield s
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        # set, not reset: a streaming generator may finish in another context
+        _span.set(parent)
+        observe("rag_span_seconds", (s.end_ns - s.start_ns) / 1e9, span=name)
+        if s.error:
+            inc("rag_span_errors_total", span=name)
+        if tr is not None:
+            tr.add(s)
+
+def set_attrs(**attrs):
+    # Annotates the innermost open span, if any
+    s = _span.get()
+    if s is not None:
+        s.set(**attrs)
+
+def traced(name: str):
+    def wrap(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def run_async(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return run_async
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return run
+    return wrap
+
+@contextmanager
+def trace(name: str, **attrs):
+    prev = _trace.get()
+    tr = Trace(name)
+    _trace.set(tr)
+    try:
+        with span(name, **attrs):
+            yield tr
+    finally:
+        _trace.set(prev)
+        _export(tr)
+
+_log_lock = threading.Lock()
+
+def _export(tr: Trace):
+    path = load_app_config().trace_log_path
+    if not path:
+        return
+    with tr._lock:
+        lines = [json.dumps(s.otel(), default=str) for s in tr.spans]
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with _log_lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+# Metrics: (name, sorted label items) -> value. Histograms keep cumulative
+# bucket counts plus sum and count, as Prometheus expects.
+
+_metrics_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_histograms: Dict[Tuple[str, Tuple], List[float]] = {}
+
+def inc(name: str, value: float = 1.0, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+def observe(name: str, value: float, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(items, extra: Tuple = ()) -> str:
+    items = tuple(items) + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+def render_metrics() -> str:
+    with _metrics_lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+    out, typed = [], set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            out.append(f"# TYPE {name} counter")
+            typed.add(name)
+        out.append(f"{name}{_labels(labels)} {value:g}")
+    for (name, labels), h in histograms:
+        if name not in typed:
+            out.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        for bound, n in zip(LATENCY_BUCKETS, h):
+            out.append(f"{name}_bucket{_labels(labels, (('le', f'{bound:g}'),))} {n:g}")
+        out.append(f"{name}_bucket{_labels(labels, (('le', '+Inf'),))} {h[-1]:g}")
+        out.append(f"{name}_sum{_labels(labels)} {h[-2]:g}")
+        out.append(f"{name}_count{_labels(labels)} {h[-1]:g}")
+    return "\n".join(out) + "\n"
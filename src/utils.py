@@ -1,10 +1,18 @@
 import hashlib
+import os
 import time
 from contextlib import contextmanager
 
 def hash_text(s: str) -> str:
     return hashlib.sha1(s.encode('utf-8')).hexdigest()[:16]
 
+def normalize_question(q: str) -> str:
+    return " ".join(q.lower().split())
+
+def approx_tokens(s: str) -> int:
+    # ~4 characters per token for English text; good enough for budgeting
+    return len(s) // 4 + 1
+
 @contextmanager
 def timer():
     class T: 
@@ -17,6 +25,17 @@ def timer():
         t.end = time.time()
         t.elapsed_ms = (t.end - t.start) * 1000
 
+@contextmanager
+def atomic_path(path: str):
+    # Write to a sibling temp file and rename over the target on success
+    tmp = f"{path}.tmp"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
 def fmt_citation(c):
     loc = ""
     if c.get("page"):
@@ -0,0 +1,236 @@
+from typing import Any, Dict, Optional
+import json, math, os, time
+import numpy as np
+from src.config import load_app_config
+from src.utils import atomic_path
+
+# faiss is imported inside the functions that need it: it is the slowest
+# import in the package, and processes that never touch an index (parse
+# workers, the UI before the first question) shouldn't pay for it
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+# Order used by FAISS_INDEX_TYPE=auto when the corpus grows
+AUTO_ORDER = ("flat", "hnsw", "ivf_pq")
+
+def read_index(path: str):
+    import faiss
+    return faiss.read_index(path)
+
+def write_index(index, path: str):
+    import faiss
+    with atomic_path(path) as tmp:
+        faiss.write_index(index, tmp)
+
+def choose_index_type(n: int, cfg=None) -> str:
+    cfg = cfg or load_app_config()
+    if cfg.faiss_index_type != "auto":
+        return cfg.faiss_index_type
+    if n < cfg.faiss_auto_hnsw_min:
+        return "flat"
+    if n < cfg.faiss_auto_ivfpq_min:
+        return "hnsw"
+    return "ivf_pq"
+
+def _base(index):
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+def is_id_mapped(index) -> bool:
+    import faiss
+    return isinstance(faiss.downcast_index(index), faiss.IndexIDMap)
+
+def index_kind(index) -> str:
+    import faiss
+    index = _base(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def _nlist(n: int, cfg) -> int:
+    nlist = cfg.faiss_nlist or int(4 * math.sqrt(n))
+    # k-means wants ~39 training points per centroid
+    return max(1, min(nlist, n // 39))
+
+def _pq_m(d: int, wanted: int) -> int:
+    m = min(wanted, d)
+    while d % m:
+        m -= 1
+    return m
+
+def create_index(vecs: np.ndarray, ids: np.ndarray, index_type: str, cfg=None):
+    # FAISS labels are docstore ids (IndexIDMap2), never row positions
+    import faiss
+    cfg = cfg or load_app_config()
+    n, d = vecs.shape
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported FAISS index type: {index_type}")
+    # PQ codebooks need 256 training points, IVF at least one per list
+    if index_type == "ivf_pq" and n < 256:
+        index_type = "ivf_flat"
+    if index_type == "ivf_flat" and n < 39:
+        index_type = "flat"
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, cfg.faiss_hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = cfg.faiss_ef_construction
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist(n, cfg)
+        quantizer = faiss.IndexFlatIP(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, _pq_m(d, cfg.faiss_pq_m), 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(vecs)
+    else:
+        index = faiss.IndexFlatIP(d)
+    index = faiss.IndexIDMap2(index)
+    index.add_with_ids(vecs, np.asarray(ids, dtype=np.int64))
+    return index
+
+def all_vectors(index):
+    # (vectors, ids). Exact for flat/HNSW/IVF-Flat, approximate for PQ codes.
+    # Only flat indexes ever have ids removed, so the inner ids of the
+    # others stay sequential and the IVF direct map can be built.
+    import faiss
+    base = _base(index)
+    if isinstance(base, faiss.IndexIVF):
+        base.make_direct_map()
+    vecs = base.reconstruct_n(0, base.ntotal)
+    if is_id_mapped(index):
+        ids = faiss.vector_to_array(faiss.downcast_index(index).id_map)
+    else:
+        ids = np.arange(index.ntotal, dtype=np.int64)  # legacy: row == docstore id
+    return vecs, ids
+
+def remove_vectors(index, ids) -> bool:
+    # Physically drop ids where that's cheap (flat); other index types keep
+    # them until compaction and rely on docstore tombstones at search time
+    if not is_id_mapped(index) or index_kind(index) != "flat" or not len(ids):
+        return False
+    index.remove_ids(np.asarray(ids, dtype=np.int64))
+    return True
+
+def search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    import faiss
+    cfg = load_app_config()
+    kind = index_kind(index)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search or cfg.faiss_ef_search)
+    if kind in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=nprobe or cfg.faiss_nprobe)
+    return None
+
+def recall_report(index, vecs: np.ndarray, ids: np.ndarray, k: int = 10, n_queries: int = 200) -> Dict[str, Any]:
+    import faiss
+    n = len(vecs)
+    rng = np.random.default_rng(0)
+    qs = vecs[rng.choice(n, size=min(n_queries, n), replace=False)]
+    # Jitter the probes so they are not trivially their own nearest neighbour
+    qs = qs + rng.normal(scale=0.05, size=qs.shape).astype(np.float32)
+    qs /= np.linalg.norm(qs, axis=1, keepdims=True)
+    k = min(k, n)
+
+    flat = faiss.IndexFlatIP(vecs.shape[1])
+    flat.add(vecs)
+    t0 = time.perf_counter()
+    _, truth = flat.search(qs, k)
+    truth = ids[truth]
+    flat_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    _, got = index.search(qs, k, params=search_params(index))
+    index_ms = (time.perf_counter() - t0) * 1000
+
+    hits = sum(len(set(t) & set(g)) for t, g in zip(truth, got))
+    return {
+        "index_type": index_kind(index),
+        "ntotal": int(index.ntotal),
+        "k": k,
+        "queries": len(qs),
+        "recall_at_k": round(hits / (k * len(qs)), 4),
+        "flat_ms_per_query": round(flat_ms / len(qs), 4),
+        "index_ms_per_query": round(index_ms / len(qs), 4),
+    }
+
+def write_report(report: Dict[str, Any], path: Optional[str] = None):
+    path = path or load_app_config().faiss_report_path
+    with atomic_path(path) as tmp:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+def add_vectors(path: str, new_vecs: np.ndarray, new_ids: np.ndarray):
+    # Append to the on-disk index, rebuilding when `auto` calls for a
+    # bigger index type, when the index predates id mapping, or when none
+    # exists yet. Returns (index, report|None).
+    import faiss
+    cfg = load_app_config()
+    if os.path.exists(path):
+        index = faiss.read_index(path)
+        total = index.ntotal + len(new_vecs)
+        want = choose_index_type(total, cfg)
+        have = index_kind(index)
+        upgrade = (cfg.faiss_index_type == "auto" and want in AUTO_ORDER and have in AUTO_ORDER
+                   and AUTO_ORDER.index(want) > AUTO_ORDER.index(have))
+        if is_id_mapped(index) and not upgrade:
+            index.add_with_ids(new_vecs, np.asarray(new_ids, dtype=np.int64))
+            return index, None
+        if not upgrade:
+            want = have
+        old_vecs, old_ids = all_vectors(index)
+        vecs = np.vstack([old_vecs, new_vecs])
+        ids = np.concatenate([old_ids, np.asarray(new_ids, dtype=np.int64)])
+    else:
+        vecs, ids = new_vecs, np.asarray(new_ids, dtype=np.int64)
+        want = choose_index_type(len(vecs), cfg)
+    index = create_index(vecs, ids, want, cfg)
+    return index, recall_report(index, vecs, ids)
+
+def _drop_codes(index, keep: np.ndarray):
+    # IVF-PQ without the dead entries: the trained quantizer and codebooks are
+    # kept and the surviving codes copied over as they are. Decoding and
+    # re-encoding would lose a little more precision on every compaction.
+    import faiss
+    base = _base(index)
+    fresh = faiss.clone_index(base)
+    fresh.reset()
+    out = faiss.IndexIDMap2(fresh)
+    # Inner ids are renumbered densely, in the old order
+    inner_new = np.cumsum(keep, dtype=np.int64) - 1
+    lists, code_size = base.invlists, base.code_size
+    for l in range(base.nlist):
+        size = lists.list_size(l)
+        if not size:
+            continue
+        inner = faiss.rev_swig_ptr(lists.get_ids(l), size).copy()
+        codes = faiss.rev_swig_ptr(lists.get_codes(l), size * code_size).copy().reshape(size, code_size)
+        sel = keep[inner]
+        if sel.any():
+            new_ids = np.ascontiguousarray(inner_new[inner[sel]])
+            new_codes = np.ascontiguousarray(codes[sel])
+            fresh.invlists.add_entries(l, len(new_ids), faiss.swig_ptr(new_ids), faiss.swig_ptr(new_codes))
+    fresh.ntotal = int(keep.sum())
+    ids = faiss.vector_to_array(faiss.downcast_index(index).id_map)[keep]
+    faiss.copy_array_to_vector(np.ascontiguousarray(ids), out.id_map)
+    out.ntotal = fresh.ntotal
+    out.construct_rev_map()
+    return out
+
+def rebuild_without(index, dead_ids):
+    # Compaction: same index type, dead ids dropped. Returns (index, report|None).
+    vecs, ids = all_vectors(index)
+    keep = ~np.isin(ids, np.asarray(list(dead_ids), dtype=np.int64))
+    if not keep.any():
+        return None, None
+    vecs, ids = vecs[keep], ids[keep]
+    if index_kind(index) == "ivf_pq" and is_id_mapped(index):
+        # The report then measures against decoded vectors, not the originals
+        index = _drop_codes(index, keep)
+    else:
+        index = create_index(vecs, ids, index_kind(index))
+    return index, recall_report(index, vecs, ids)